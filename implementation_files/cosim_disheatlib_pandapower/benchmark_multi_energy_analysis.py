@@ -117,25 +117,52 @@ def get_sim_node_name(
 def retrieve_results(
     store_name,
     start_time,
-    drop_first_days_data = True
+    drop_first_days_data = True,
+    names = None
 ):
+    '''
+    Read results from a store. Only the results with the given names ('entity.attr') are
+    read (default: all). All results of a frame share the same time index.
+    '''
     results_dict = {}
-    results_store = pd.HDFStore(store_name)
-
-    for collector in results_store:
-        for (simulator, attribute), data in results_store[collector].items():
-            # Retrieve short name of data.
-            sim_node_name = get_sim_node_name(simulator)
-            res_name = '.'.join([sim_node_name, attribute])
-
-            # Convert index to time format.
-            data.index = pd.to_datetime(data.index, unit = 's', origin = start_time)
-
-            if drop_first_days_data:
-                first_days_data = data.first('2D')
-                results_dict[res_name] = data.drop(first_days_data.index)
-            else:
-                results_dict[res_name] = data
+    results_store = pd.HDFStore(store_name, 'r')
+
+    for collector in results_store.keys():
+        storer = results_store.get_storer(collector)
+
+        # Columns of the frame (without reading the data, if stored as table).
+        if storer.is_table:
+            columns = storer.non_index_axes[0][1]
+        else:
+            data = results_store[collector]
+            columns = list(data.columns)
+
+        selected = {}
+        for column in columns:
+            if not isinstance(column, tuple) or len(column) != 2:
+                continue
+            (simulator, attribute) = column
+            res_name = '.'.join([get_sim_node_name(simulator), attribute])
+            if names is None or res_name in names:
+                selected[column] = res_name
+
+        if not selected:
+            continue
+
+        if storer.is_table:
+            data = results_store.select(collector, columns = list(selected))
+        else:
+            data = data[list(selected)]
+
+        # Convert index to time format (once for all results of the frame).
+        seconds = data.index.values
+        if drop_first_days_data:
+            # Drop the data of the first two simulated days.
+            data = data.iloc[seconds.searchsorted(seconds[0] + 2 * 24 * 60 * 60):]
+        data.index = pd.to_datetime(data.index, unit = 's', origin = start_time)
+
+        for column, res_name in selected.items():
+            results_dict[res_name] = data[column]
 
     results_store.close()
     return results_dict
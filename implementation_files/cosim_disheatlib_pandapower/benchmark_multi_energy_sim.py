@@ -13,6 +13,15 @@ END = 7 * 24 * 60 * 60
 POWER_DEMAND_LOAD_PROFILES = 'resources/power/power_demand_load_profiles.csv'
 PV_GENERATION_PROFILES = 'resources/power/pv_generation_profiles.csv'
 
+# Number of time steps after which the collected results are appended to the results file.
+H5_FLUSH_STEPS = 24 * 60
+
+# Number of blocks of results that can be queued for the background writer thread.
+H5_WRITER_QUEUE_SIZE = 2
+
+# Collected attributes that are only recorded when they change (absolute tolerance per attribute).
+DELTA_RECORDING = {'state': 0, 'hp_on_request': 0, 'hp_off_request': 0, 'hp_p_el_kw_setpoint': 0}
+
 # MOSAIK simulator configuration.
 SIM_CONFIG = {
     'DHNetworkSim': {
@@ -38,24 +47,19 @@ SIM_CONFIG = {
 
 def loadProfiles():
     '''
-    Load profiles for demand (heat, power) and PV generation.
+    Load profiles for demand (heat, power) and PV generation. The parsed profiles are cached
+    in binary form (see simulators.time_series_player.profile_cache).
     '''
-    import pandas as pd
     import pathlib
+    from simulators.time_series_player import load_csv_profile
 
     profiles = {}
 
     here = pathlib.Path(__file__).resolve().parent
 
-    profiles['power_demand'] = pd.read_csv(
-        pathlib.Path(here, POWER_DEMAND_LOAD_PROFILES),
-        index_col = 0, parse_dates = True
-    )
+    profiles['power_demand'] = load_csv_profile(pathlib.Path(here, POWER_DEMAND_LOAD_PROFILES))
 
-    profiles['pv_generation'] = pd.read_csv(
-        pathlib.Path(here, PV_GENERATION_PROFILES),
-        index_col = 0, parse_dates = True
-    )
+    profiles['pv_generation'] = load_csv_profile(pathlib.Path(here, PV_GENERATION_PROFILES))
 
     return profiles
 
@@ -92,7 +96,8 @@ def initializeSimulators(world, step_size, outfile_name):
     simulators['load_gen_profiles'] = world.start(
         'TimeSeriesSim',
         eid_prefix = 'power_demand',
-        step_size = step_size
+        step_size = step_size,
+        fieldnames = ['Load_1', 'Load_2', 'PV_1', 'PV_2']
     )
 
     # Flex heat controller.
@@ -114,7 +119,10 @@ def initializeSimulators(world, step_size, outfile_name):
         print_results = False,
         save_h5 = True,
         h5_store_name = outfile_name,
-        h5_frame_name = 'results'
+        h5_frame_name = 'results',
+        h5_flush_steps = H5_FLUSH_STEPS,
+        h5_writer_queue_size = H5_WRITER_QUEUE_SIZE,
+        delta_recording = DELTA_RECORDING
     )
 
     return simulators
@@ -124,8 +132,14 @@ def instantiateEntities(simulators, profiles, voltage_control_enabled = True):
     '''
     Create instances of simulators.
     '''
+    from simulators.time_series_player import register_profile
+
     entities = {}
 
+    # Share the profiles between all time series players.
+    for name, profile in profiles.items():
+        register_profile(name, profile)
+
     # Electrical network.
     entities['el_network'] = simulators['el_network'].Grid(
         gridfile = 'resources/power/power_grid_model.json',
@@ -138,35 +152,17 @@ def instantiateEntities(simulators, profiles, voltage_control_enabled = True):
     entities.update( {element.eid: element for element in grid if element.type in 'Bus'} )
     entities.update( {element.eid: element for element in grid if element.type in 'Line'} )
 
-    # Time series player for the power consumption profile of load 1.
-    entities['consumer_load1'] = simulators['load_gen_profiles'].TimeSeriesPlayer(
-        t_start = START_TIME,
-        series = profiles['power_demand'].copy(),
-        fieldname = 'Load_1',
-        interp_method = 'pchip',
-    )
-
-    # Time series player for the power consumption profile of load 2.
-    entities['consumer_load2'] = simulators['load_gen_profiles'].TimeSeriesPlayer(
-        t_start = START_TIME,
-        series = profiles['power_demand'].copy(),
-        fieldname = 'Load_2',
-        interp_method = 'pchip',
-    )
-
-    # Time series player for generation profile of PV 1.
-    entities['gen_pv1'] = simulators['load_gen_profiles'].TimeSeriesPlayer(
+    # Time series player for the power consumption profiles of all loads (outputs 'Load_1', 'Load_2').
+    entities['consumer_loads'] = simulators['load_gen_profiles'].MultiTimeSeriesPlayer(
         t_start = START_TIME,
-        series = profiles['pv_generation'].copy(),
-        fieldname = 'PV_1',
+        series = 'power_demand',
         interp_method = 'pchip',
     )
 
-    # Time series player for generation profile of PV 2.
-    entities['gen_pv2'] = simulators['load_gen_profiles'].TimeSeriesPlayer(
+    # Time series player for the generation profiles of all PVs (outputs 'PV_1', 'PV_2').
+    entities['gen_pvs'] = simulators['load_gen_profiles'].MultiTimeSeriesPlayer(
         t_start = START_TIME,
-        series = profiles['pv_generation'].copy(),
-        fieldname = 'PV_2',
+        series = 'pv_generation',
         interp_method = 'pchip',
     )
 
@@ -203,12 +199,12 @@ def connectEntities(world, entities):
     from simulators.el_network.simulator import make_eid as el_grid_id
 
     # Connect electrical consumption profiles to electrical loads.
-    world.connect(entities['consumer_load1'], entities[el_grid_id('Load_1',0)], ('out', 'p_mw'))
-    world.connect(entities['consumer_load2'], entities[el_grid_id('Load_2',0)], ('out', 'p_mw'))
+    world.connect(entities['consumer_loads'], entities[el_grid_id('Load_1',0)], ('Load_1', 'p_mw'))
+    world.connect(entities['consumer_loads'], entities[el_grid_id('Load_2',0)], ('Load_2', 'p_mw'))
 
     # Connect PV profiles to static generators.
-    world.connect(entities['gen_pv1'], entities[el_grid_id('PV_1',0)], ('out', 'p_mw'))
-    world.connect(entities['gen_pv2'], entities[el_grid_id('PV_2',0)], ('out', 'p_mw'))
+    world.connect(entities['gen_pvs'], entities[el_grid_id('PV_1',0)], ('PV_1', 'p_mw'))
+    world.connect(entities['gen_pvs'], entities[el_grid_id('PV_2',0)], ('PV_2', 'p_mw'))
 
     # Connect heat pump to electrical grid.
     world.connect(entities['dh_network'], entities[el_grid_id('Heat Pump',0)], ('P_el_heatpump_MW', 'p_mw'),
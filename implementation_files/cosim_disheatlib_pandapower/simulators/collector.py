@@ -2,12 +2,44 @@
 # Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
 '''
 A simple data collector that prints all data when the simulator ends.
+
+Optionally, the data is streamed to the HDF5 store during the simulation: every
+h5_flush_steps steps the collected block is appended to a compressed table, such that
+memory is bounded by the block size and the results of an interrupted run are kept.
+
+Attributes can also be aggregated over time windows instead of being recorded at every
+step, e.g., aggregation={'vm_pu': {'window': 900, 'stats': ['min', 'max', 'mean']}}.
+Available statistics are 'mean', 'min', 'max', 'last' and 'time_above' (time in seconds
+with values above the given 'threshold'). The statistics of all attributes with the same
+window are stored in frame "<h5_frame_name>_<window>s", with attributes "<attr>_<stat>".
+
+With h5_writer_queue_size > 0, the blocks are written by a background thread, such that
+compression and disk I/O overlap with the simulation. The queue is bounded: if the writer
+falls behind, the collector waits until a block has been written.
+
+Slowly varying attributes can be recorded only when they change by more than a tolerance,
+e.g., delta_recording={'state': 0, 'hp_p_el_kw_setpoint': 0.1}. Their values are stored
+as dense series (last recorded value at every step) when the results are saved.
+
+With output_format='parquet', the results are written to a Parquet dataset (requires
+pyarrow) instead of the HDF5 store, partitioned by scenario and simulation day and with
+the scenario parameters as metadata (see ParquetWriter and read_parquet_results).
 '''
 
 import collections
+import json
+import numbers
+import pathlib
+import queue
+import shutil
+import threading
+import time as timer
 import mosaik_api
+import numpy as np
 import pandas as pd
 
+SECONDS_PER_DAY = 24 * 60 * 60
+
 META = {
         'models': {
                 'Collector': {
@@ -20,6 +52,515 @@ META = {
     }
 
 
+class ColumnBuffer:
+    '''
+    Growable buffers for the collected data, one row per step and one column per
+    (source, attribute). Numbers are stored as float64, booleans as bool and all other
+    values as objects. The column layout is compiled from the first collected values.
+    '''
+
+    # Value stored for a column without input at a step
+    FILL_VALUES = {'float': np.nan, 'bool': False, 'object': None}
+    DTYPES = {'float': np.float64, 'bool': np.bool_, 'object': object}
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.nrows = 0
+        self.times = np.empty(capacity, dtype=np.int64)
+        self.buffers = {kind: self._allocate(kind, capacity, 0) for kind in self.DTYPES}
+        self.ncols = {kind: 0 for kind in self.DTYPES}  # Number of used columns per buffer
+        self.columns = {}  # Position of each column ((source, attribute) -> (kind, index))
+        self.sources = {}  # Attributes per source, in order of appearance (source -> list of attributes)
+        self.integers = set()  # Float columns created from integer values
+        self.float_rows = {}  # Sources and float columns of attributes with only float columns (attribute -> (sources, indices))
+
+    def _allocate(self, kind, nrows, ncols):
+        return np.full((nrows, ncols), self.FILL_VALUES[kind], dtype=self.DTYPES[kind])
+
+    def _grow(self, kind, nrows, ncols):
+        buffer = self.buffers[kind]
+        new_buffer = self._allocate(kind, nrows, ncols)
+        new_buffer[:self.nrows, :buffer.shape[1]] = buffer[:self.nrows]
+        self.buffers[kind] = new_buffer
+
+    def add_row(self, time):
+        if self.nrows == self.capacity:
+            self.capacity *= 2
+            for kind, buffer in self.buffers.items():
+                self._grow(kind, self.capacity, buffer.shape[1])
+            self.times = np.resize(self.times, self.capacity)
+
+        self.times[self.nrows] = time
+        self.nrows += 1
+
+    def add_column(self, src, attr, value):
+        if isinstance(value, (bool, np.bool_)):
+            kind = 'bool'
+        elif isinstance(value, numbers.Real):
+            kind = 'float'
+            if isinstance(value, numbers.Integral):
+                self.integers.add((src, attr))
+        else:
+            kind = 'object'
+
+        if (src, attr) not in self.columns:
+            self.sources.setdefault(src, []).append(attr)
+        return self._new_column(src, attr, kind)
+
+    def _new_column(self, src, attr, kind):
+        index = self.ncols[kind]
+        if index == self.buffers[kind].shape[1]:
+            self._grow(kind, self.capacity, max(2 * index, 8))
+        self.ncols[kind] += 1
+        self.columns[(src, attr)] = (kind, index)
+        return kind, index
+
+    def to_object(self, src, attr):
+        '''
+        Move a column to the object buffer (for values that do not match the type of the column).
+        '''
+        kind, index = self.columns[(src, attr)]
+        values = self.buffers[kind][:self.nrows, index].tolist()
+        kind, index = self._new_column(src, attr, 'object')
+        self.buffers[kind][:self.nrows, index] = values
+        self.integers.discard((src, attr))
+        return kind, index
+
+    def set_values(self, data):
+        '''
+        Store the values of the current row (data: attribute -> source -> value).
+        '''
+        row = self.nrows - 1
+        columns = self.columns
+        floats, bools, objects = self.buffers['float'], self.buffers['bool'], self.buffers['object']
+
+        for attr, values in data.items():
+            # Fast path, all values of the attribute are stored at once.
+            float_row = self.float_rows.get(attr)
+            if float_row is not None and float_row[0] == tuple(values):
+                try:
+                    floats[row, float_row[1]] = np.fromiter(values.values(), np.float64, len(values))
+                    continue
+                except (TypeError, ValueError):
+                    pass
+
+            for src, value in values.items():
+                try:
+                    kind, index = columns[(src, attr)]
+                except KeyError:
+                    kind, index = self.add_column(src, attr, value)
+                    floats, bools, objects = self.buffers['float'], self.buffers['bool'], self.buffers['object']
+
+                if kind == 'float':
+                    try:
+                        floats[row, index] = value
+                        continue
+                    except (TypeError, ValueError):
+                        pass
+                elif kind == 'bool' and isinstance(value, (bool, np.bool_)):
+                    bools[row, index] = value
+                    continue
+                elif kind == 'object':
+                    objects[row, index] = value
+                    continue
+
+                kind, index = self.to_object(src, attr)
+                objects = self.buffers['object']
+                objects[row, index] = value
+
+            self._update_float_row(attr, values)
+
+    def _update_float_row(self, attr, values):
+        positions = [self.columns[(src, attr)] for src in values]
+        if all(kind == 'float' for kind, _ in positions):
+            self.float_rows[attr] = (tuple(values), np.array([index for _, index in positions], dtype=np.intp))
+        else:
+            self.float_rows.pop(attr, None)
+
+    def get_column(self, src, attr):
+        kind, index = self.columns[(src, attr)]
+        values = self.buffers[kind][:self.nrows, index]
+
+        # Restore integer columns (as long as all values are integers).
+        if (src, attr) in self.integers and np.isfinite(values).all() and (values == np.trunc(values)).all():
+            values = values.astype(np.int64)
+        return values
+
+    def get_columns(self):
+        return {(src, attr): self.get_column(src, attr) for src, attrs in self.sources.items() for attr in attrs}
+
+    def get_frame(self):
+        '''
+        Collected data as data frame (columns: source, attribute).
+        '''
+        return _make_frame(self.get_columns(), self.times[:self.nrows].copy())
+
+    def clear(self):
+        '''
+        Remove all rows, keeping the column layout.
+        '''
+        for kind, buffer in self.buffers.items():
+            buffer[:self.nrows] = self.FILL_VALUES[kind]
+        self.nrows = 0
+
+
+class DeltaRecorder:
+    '''
+    Change-only recording of attributes. A value is stored (with its time) only if it differs
+    from the last stored value of the same source and attribute by more than the tolerance.
+    '''
+
+    def __init__(self, tolerances):
+        self.tolerances = dict(tolerances)  # Absolute tolerance per attribute
+        self.records = {}  # Stored times and values ((source, attribute) -> (times, values))
+        self.sources = {}  # Attributes per source, in order of appearance (source -> list of attributes)
+        self.nsamples = 0  # Number of received values
+        self.nstored = 0  # Number of stored values
+
+    @staticmethod
+    def _changed(last, value, tolerance):
+        if _is_number(last) and _is_number(value):
+            if np.isnan(last) and np.isnan(value):
+                return False
+            return not abs(value - last) <= tolerance
+        return not (last is value or last == value)
+
+    def add(self, time, data):
+        '''
+        Record the values (attribute -> source -> value) at the given time.
+        '''
+        for attr, values in data.items():
+            tolerance = self.tolerances[attr]
+            for src, value in values.items():
+                self.nsamples += 1
+                record = self.records.get((src, attr))
+                if record is None:
+                    record = self.records[(src, attr)] = ([], [])
+                    self.sources.setdefault(src, []).append(attr)
+                elif not self._changed(record[1][-1], value, tolerance):
+                    continue
+
+                record[0].append(time)
+                record[1].append(value)
+                self.nstored += 1
+
+    def get_column(self, src, attr, times):
+        '''
+        Dense series of the recorded values at the given times.
+        '''
+        record_times, record_values = self.records[(src, attr)]
+        return pd.Series(record_values, index=record_times).reindex(times, method='ffill').to_numpy()
+
+    def get_columns(self, times):
+        return {(src, attr): self.get_column(src, attr, times) for src, attrs in self.sources.items() for attr in attrs}
+
+    def clear(self):
+        '''
+        Remove all records except for the last value (still valid at the following steps).
+        '''
+        for key, (record_times, record_values) in self.records.items():
+            self.records[key] = (record_times[-1:], record_values[-1:])
+
+
+class WindowAggregator:
+    '''
+    Statistics of an attribute over time windows, updated incrementally at every step.
+    '''
+
+    STATS = ('mean', 'min', 'max', 'last', 'time_above')
+
+    def __init__(self, attr, window, stats, threshold=None, step_size=1):
+        unknown = set(stats) - set(self.STATS)
+        if unknown:
+            raise ValueError('Unknown statistics for attribute {0}: {1}'.format(attr, ', '.join(sorted(unknown))))
+        if 'time_above' in stats and threshold is None:
+            raise ValueError('Statistic time_above of attribute {0} requires a threshold.'.format(attr))
+
+        self.attr = attr
+        self.window = window  # Window length in seconds
+        self.stats = list(stats)
+        self.threshold = threshold
+        self.step_size = step_size  # Time represented by one value in seconds
+
+        self.sources = []
+        self.positions = {}  # Position of each source in the accumulators
+        self.window_start = None
+        self._reset()
+
+    def _reset(self):
+        n = len(self.sources)
+        self.sum = np.zeros(n)
+        self.count = np.zeros(n)
+        self.min = np.full(n, np.nan)
+        self.max = np.full(n, np.nan)
+        self.last = np.full(n, np.nan)
+        self.above = np.zeros(n)
+
+    def _add_sources(self, sources):
+        for src in sources:
+            self.positions[src] = len(self.sources)
+            self.sources.append(src)
+
+        n = len(sources)
+        self.sum = np.append(self.sum, np.zeros(n))
+        self.count = np.append(self.count, np.zeros(n))
+        self.min = np.append(self.min, np.full(n, np.nan))
+        self.max = np.append(self.max, np.full(n, np.nan))
+        self.last = np.append(self.last, np.full(n, np.nan))
+        self.above = np.append(self.above, np.zeros(n))
+
+    def add(self, time, values):
+        '''
+        Add the values (source -> value) at the given time.
+        :return: tuple (window start, statistics) of the previous window if it is completed, otherwise None
+        '''
+        result = None
+        window_start = time - time % self.window
+        if self.window_start is not None and window_start != self.window_start:
+            result = self.window_start, self.get_stats()
+            self._reset()
+        self.window_start = window_start
+
+        new_sources = [src for src in values if src not in self.positions]
+        if new_sources:
+            self._add_sources(new_sources)
+
+        x = np.full(len(self.sources), np.nan)
+        for src, value in values.items():
+            x[self.positions[src]] = value
+
+        valid = ~np.isnan(x)
+        self.sum += np.where(valid, x, 0.)
+        self.count += valid
+        self.min = np.fmin(self.min, x)
+        self.max = np.fmax(self.max, x)
+        self.last = np.where(valid, x, self.last)
+        if self.threshold is not None:
+            self.above += self.step_size * (x > self.threshold)
+
+        return result
+
+    def get_stats(self):
+        '''
+        Statistics of the current window (attribute name -> source -> value).
+        '''
+        with np.errstate(invalid='ignore', divide='ignore'):
+            values = {
+                'mean': self.sum / self.count,
+                'min': self.min,
+                'max': self.max,
+                'last': self.last,
+                'time_above': self.above,
+            }
+        return {'{0}_{1}'.format(self.attr, stat): dict(zip(self.sources, values[stat])) for stat in self.stats}
+
+
+class ResultsWriter:
+    '''
+    Appends data frames to the results, optionally in a background thread.
+    '''
+
+    def __init__(self, queue_size=0):
+        self.dtypes = {}  # Column types of the first block per frame (numbers as float64), required for all following blocks
+
+        # Statistics
+        self.nrows = 0
+        self.nbytes = 0
+        self.write_time = 0.
+
+        self.error = None
+        self.queue = None
+        if queue_size:
+            self.queue = queue.Queue(queue_size)
+            self.thread = threading.Thread(target=self._run, name=type(self).__name__, daemon=True)
+            self.thread.start()
+
+    def write(self, frames):
+        '''
+        Append data frames (frame name -> data frame). Blocks if the queue of the writer thread is full.
+        '''
+        if self.queue is None:
+            self._write(frames)
+        else:
+            self._check()
+            self.queue.put(frames)
+
+    def close(self):
+        '''
+        Write all queued data frames and stop the writer thread.
+        '''
+        if self.queue is not None:
+            self.queue.put(None)
+            self.thread.join()
+        self._check()
+
+    def _check(self):
+        if self.error is not None:
+            raise RuntimeError('Writing results to {0} failed.'.format(self.location)) from self.error
+
+    def _run(self):
+        while True:
+            frames = self.queue.get()
+            if frames is None:
+                return
+            if self.error is None:
+                try:
+                    self._write(frames)
+                except Exception as e:
+                    self.error = e
+
+    def _write(self, frames):
+        start_time = timer.perf_counter()
+
+        for name, panel in frames.items():
+            # Integer columns are restored per block, store all numbers as float64 to keep the blocks compatible.
+            panel = panel.astype({col: np.float64 for col, dtype in panel.dtypes.items()
+                                  if dtype.kind in 'iuf' and dtype != np.float64})
+
+            first = name not in self.dtypes
+            if first:
+                self.dtypes[name] = panel.dtypes
+            else:
+                panel = self._cast(name, panel)
+            self.append(name, panel, first)
+
+            self.nrows += len(panel)
+            self.nbytes += panel.memory_usage(deep=True).sum()
+
+        self.write_time += timer.perf_counter() - start_time
+
+    def _cast(self, name, panel):
+        '''
+        Cast a block to the column types of the first block of the frame (only lossless casts to object columns).
+        '''
+        dtypes = self.dtypes[name]
+        changed = {col: dtype for col, dtype in panel.dtypes.items() if col in dtypes.index and dtype != dtypes[col]}
+
+        lossy = [col for col in changed if dtypes[col] != object]
+        if lossy:
+            raise TypeError('Column types of frame {0} changed: {1}.'.format(
+                name, ', '.join('{0} ({1} -> {2})'.format(col, dtypes[col], changed[col]) for col in lossy)))
+        return panel.astype({col: object for col in changed})
+
+    def append(self, name, panel, first):
+        '''
+        Append a data frame to the results (first: first block of the frame, replaces results of previous runs).
+        '''
+        raise NotImplementedError
+
+
+class H5Writer(ResultsWriter):
+    '''
+    Appends data frames to tables in an HDF5 store.
+    '''
+
+    def __init__(self, store_name, complevel=5, complib='blosc', queue_size=0):
+        self.location = store_name
+        self.complevel = complevel
+        self.complib = complib
+        super().__init__(queue_size)
+
+    def append(self, name, panel, first):
+        with pd.HDFStore(self.location, complevel=self.complevel, complib=self.complib) as store:
+            if first and name in store:
+                store.remove(name)
+            store.append(name, panel, format='table')
+
+
+class ParquetWriter(ResultsWriter):
+    '''
+    Writes data frames to a Parquet dataset, partitioned by frame, scenario and day:
+    <root>/<frame name>/scenario=<scenario id>/day=<day>/part-<n>.parquet
+
+    Each file has a column 'time' (simulation time in seconds) and one column per collected
+    attribute, named "<source>.<attribute>". The scenario parameters are stored as JSON in
+    the metadata of each file (key 'scenario').
+    '''
+
+    def __init__(self, root, scenario_id='default', scenario_params=None, compression='zstd', queue_size=0):
+        self.location = root
+        self.scenario_id = scenario_id
+        self.scenario_params = scenario_params or {}
+        self.compression = compression
+        self.nparts = 0
+        super().__init__(queue_size)
+
+    def append(self, name, panel, first):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        scenario_dir = pathlib.Path(self.location, name, 'scenario={0}'.format(self.scenario_id))
+        if first and scenario_dir.exists():
+            shutil.rmtree(scenario_dir)
+
+        panel = panel.copy(deep=False)
+        panel.columns = ['.'.join(column) for column in panel.columns]
+        panel.index = panel.index.rename('time')
+        metadata = {b'scenario': json.dumps(dict(self.scenario_params, scenario_id=self.scenario_id), default=str).encode()}
+
+        days = panel.index.values // SECONDS_PER_DAY
+        for day in np.unique(days):
+            table = pa.Table.from_pandas(panel[days == day].reset_index(), preserve_index=False)
+            table = table.replace_schema_metadata({**(table.schema.metadata or {}), **metadata})
+
+            day_dir = scenario_dir / 'day={0}'.format(day)
+            day_dir.mkdir(parents=True, exist_ok=True)
+            pq.write_table(table, day_dir / 'part-{0:05d}.parquet'.format(self.nparts), compression=self.compression)
+            self.nparts += 1
+
+
+def read_parquet_results(root, name='results', columns=None, scenarios=None, days=None):
+    '''
+    Read results written by ParquetWriter. Only the requested columns, scenarios and days are read.
+    :param columns: list of "<source>.<attribute>" columns (default: all)
+    :param scenarios: list of scenario ids (default: all)
+    :param days: tuple (first day, last day) of simulation days (default: all)
+    :return: data frame with index (scenario, time) and columns (source, attribute)
+    '''
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    partitioning = ds.partitioning(pa.schema([('scenario', pa.string()), ('day', pa.int64())]), flavor='hive')
+    dataset = ds.dataset(pathlib.Path(root, name), format='parquet', partitioning=partitioning)
+
+    predicate = None
+    if scenarios is not None:
+        predicate = ds.field('scenario').isin([str(scenario) for scenario in scenarios])
+    if days is not None:
+        day_predicate = (ds.field('day') >= days[0]) & (ds.field('day') <= days[1])
+        predicate = day_predicate if predicate is None else predicate & day_predicate
+
+    if columns is not None:
+        columns = ['scenario', 'time'] + list(columns)
+
+    panel = dataset.to_table(columns=columns, filter=predicate).to_pandas()
+    panel = panel.drop(columns='day', errors='ignore').set_index(['scenario', 'time']).sort_index()
+    panel.columns = pd.MultiIndex.from_tuples([tuple(column.rsplit('.', 1)) for column in panel.columns])
+    return panel
+
+
+def read_scenario_params(root, name='results'):
+    '''
+    Parameters of all scenarios in a Parquet dataset written by ParquetWriter (scenario id -> parameters).
+    '''
+    import pyarrow.parquet as pq
+
+    params = {}
+    for path in sorted(pathlib.Path(root, name).glob('scenario=*/day=*/*.parquet')):
+        scenario_id = path.parent.parent.name.split('=', 1)[1]
+        if scenario_id not in params:
+            params[scenario_id] = json.loads(pq.read_schema(path).metadata[b'scenario'])
+    return params
+
+
+def _is_number(x):
+    return isinstance(x, numbers.Real) and not isinstance(x, (bool, np.bool_))
+
+
+def _make_frame(columns, index):
+    return pd.DataFrame(columns, index=index, columns=pd.MultiIndex.from_tuples(list(columns)) if columns else None)
+
+
 def _format_func(x):
     try:
         return '{0:.02f}'.format(x)
@@ -33,24 +574,51 @@ class Collector(mosaik_api.Simulator):
     save_h5 = True
     h5_store_name = ''
     h5_frame_name = ''
+    h5_flush_steps = None
 
     def __init__(self):
         super().__init__(META)
         self.eid = None
-        self.data = collections.defaultdict(
-                lambda: collections.defaultdict(list))
-        self.time_list=[]
+        self.data = None
 
         self.step_size = None
 
     def init(
             self, sid, step_size=10, print_results=True, save_h5=True,
-            h5_store_name='collector_store', h5_frame_name='default_frame'):
+            h5_store_name='collector_store', h5_frame_name='default_frame',
+            h5_flush_steps=None, h5_complevel=5, h5_complib='blosc', h5_writer_queue_size=0,
+            aggregation=None, delta_recording=None, output_format='h5', parquet_root=None,
+            scenario_id='default', scenario_params=None):
         self.step_size = step_size
         self.print_results = print_results
         self.save_h5 = save_h5
         self.h5_store_name = h5_store_name
         self.h5_frame_name = h5_frame_name
+        self.h5_flush_steps = h5_flush_steps  # Number of steps per block appended to the store (None: store all data in finalize)
+        if output_format not in ('h5', 'parquet'):
+            raise ValueError('Unknown output format: {0}'.format(output_format))
+
+        self.writer = None
+        if save_h5 and output_format == 'parquet':
+            if parquet_root is None:
+                parquet_root = str(pathlib.Path(h5_store_name).with_suffix('.parquet'))
+            self.writer = ParquetWriter(parquet_root, scenario_id, scenario_params, queue_size=h5_writer_queue_size)
+        elif save_h5 and h5_flush_steps:
+            self.writer = H5Writer(h5_store_name, h5_complevel, h5_complib, h5_writer_queue_size)
+        self.data = ColumnBuffer(h5_flush_steps or 1024)
+
+        # Attributes recorded only when they change
+        self.delta = DeltaRecorder(delta_recording or {})
+
+        # Aggregated attributes, grouped by window length (window -> (buffer, aggregators))
+        self.aggregators = {}
+        self.aggregated = {}
+        for attr, spec in (aggregation or {}).items():
+            spec = dict(spec)
+            window = spec.pop('window')
+            self.aggregators[attr] = WindowAggregator(attr, window, step_size=step_size, **spec)
+            self.aggregated.setdefault(window, (ColumnBuffer(), []))[1].append(self.aggregators[attr])
+
         return self.meta
 
     def create(self, num, model, **entity_params):
@@ -63,29 +631,109 @@ class Collector(mosaik_api.Simulator):
 
     def step(self, time, inputs):
         data = inputs.get(self.eid,{})
-        for attr, values in data.items():
-            for src, value in values.items():
-                self.data[src][attr].append(value)
-        self.time_list.append(time)
+
+        if self.aggregators:
+            self.aggregate(time, data)
+            data = {attr: values for attr, values in data.items() if attr not in self.aggregators}
+
+        if self.delta.tolerances:
+            self.delta.add(time, {attr: values for attr, values in data.items() if attr in self.delta.tolerances})
+            data = {attr: values for attr, values in data.items() if attr not in self.delta.tolerances}
+
+        self.data.add_row(time)
+        self.data.set_values(data)
+
+        if self.writer is not None and self.h5_flush_steps and self.data.nrows >= self.h5_flush_steps:
+            self.flush()
 
         return time + self.step_size
 
     def get_data(self, outputs):
         raise NotImplementedError('Collector does not allow data to be pulled from it')
 
+    def aggregate(self, time, data):
+        '''
+        Update the statistics of the aggregated attributes, store the statistics of completed windows.
+        '''
+        for buffer, aggregators in self.aggregated.values():
+            completed = [aggregator.add(time, data[aggregator.attr]) for aggregator in aggregators if aggregator.attr in data]
+            self._add_windows(buffer, completed)
+
+    def _add_windows(self, buffer, completed):
+        for window_start in sorted({result[0] for result in completed if result is not None}):
+            buffer.add_row(window_start)
+            for result in completed:
+                if result is not None and result[0] == window_start:
+                    buffer.set_values(result[1])
+
+    def get_columns(self):
+        '''
+        Data collected since the last flush (source, attribute -> values), including attributes recorded only when they change.
+        '''
+        columns = self.data.get_columns()
+        columns.update(self.delta.get_columns(self.data.times[:self.data.nrows]))
+        return columns
+
+    def get_frames(self):
+        '''
+        Data collected since the last flush as data frames (frame name -> data frame).
+        '''
+        frames = {}
+        if self.data.nrows and (self.data.columns or self.delta.records):
+            frames[self.h5_frame_name] = _make_frame(self.get_columns(), self.data.times[:self.data.nrows].copy())
+
+        for window, (buffer, _) in self.aggregated.items():
+            if buffer.nrows and buffer.columns:
+                frames['{0}_{1}s'.format(self.h5_frame_name, window)] = buffer.get_frame()
+
+        return frames
+
+    def flush(self):
+        '''
+        Append the data collected since the last flush to the tables in the store.
+        '''
+        frames = self.get_frames()
+        if not frames:
+            return
+
+        self.writer.write(frames)
+
+        self.data.clear()
+        self.delta.clear()
+        for buffer, _ in self.aggregated.values():
+            buffer.clear()
+
     def finalize(self):
+        # Statistics of the last (incomplete) windows.
+        for buffer, aggregators in self.aggregated.values():
+            self._add_windows(buffer, [(aggregator.window_start, aggregator.get_stats())
+                                       for aggregator in aggregators if aggregator.window_start is not None])
+
         if self.print_results:
+            # In streaming mode, only the data of the last block is still in memory.
             print('Collected data:')
-            for sim, sim_data in self.data.items():
+            data = collections.defaultdict(dict)
+            for (sim, attr), values in self.get_columns().items():
+                data[sim][attr] = values
+            for sim, sim_data in data.items():
                 print('- {0}'.format(sim))
                 for attr, values in sorted(sim_data.items()):
                     print('  - {0}: {1}'.format(attr, list(map(_format_func, values))))
-        if self.save_h5:
+        if self.delta.nsamples:
+            print('Change-only recording: stored {0} of {1} values'.format(self.delta.nstored, self.delta.nsamples))
+        if self.writer is not None:
+            self.flush()
+            self.writer.close()
+            print('Saved to store: {0}, table: {1}'.format(self.writer.location, ', '.join(self.writer.dtypes)))
+            print('Writer: {0} rows, {1:.1f} MB in {2:.2f} s ({3:.1f} MB/s)'.format(
+                self.writer.nrows, self.writer.nbytes / 1e6, self.writer.write_time,
+                self.writer.nbytes / 1e6 / max(self.writer.write_time, 1e-9)))
+        elif self.save_h5:
             store = pd.HDFStore(self.h5_store_name)
-            panel = pd.DataFrame({(unit,attribute): pd.Series(data, index=self.time_list) for unit, datadict in self.data.items() for attribute, data in datadict.items()})
-            #print(panel)
-            print('Saved to store: {0}, dataframe: {1}'.format(self.h5_store_name, self.h5_frame_name))
-            store[self.h5_frame_name] = panel
+            for name, panel in self.get_frames().items():
+                #print(panel)
+                print('Saved to store: {0}, dataframe: {1}'.format(self.h5_store_name, name))
+                store[name] = panel
             store.close()
 
 
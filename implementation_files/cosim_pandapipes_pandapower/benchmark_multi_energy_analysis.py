@@ -1,14 +1,18 @@
 '''
 Analysis script for the benchmark results, comparing
-results with voltage control enabled and disabled.
+results with voltage control enabled and disabled,
+or any number of runs grouped by scenario parameters.
 '''
 
 import matplotlib.pyplot as plt
+import numpy as np
 import pandas as pd
 
-START_TIME = '2019-02-01 00:00:00'
-
-DROP_FIRST_DAYS_DATA = True
+from benchmark_multi_energy_kpi import (
+    START_TIME, DROP_FIRST_DAYS_DATA,
+    BINS_BUS_VOLTAGE, BINS_LINE_LOADING, BINS_TANK_TEMPERATURE_AVG, BINS_TANK_TEMPERATURE_MAX, BINS_HP_POWER_CONSUMPTION,
+    retrieve_results, compute_kpis, write_kpis, aggregate_stores, write_group_kpis
+)
 
 PLOT_DICT = {
     'tank temperatures': [
@@ -86,65 +90,81 @@ PLOT_DICT = {
     ],
 }
 
-BINS_BUS_VOLTAGE = [
-    round(0.75 + i*.01, 2) for i in range(46)
+# Comparisons of the results with voltage control enabled and disabled (entity, attribute, label, figure id, bins).
+COMPARE_PLOTS = [
+    ('Bus_1_0', 'vm_pu', 'voltage in p.u.', 'voltage_levels_bus1', BINS_BUS_VOLTAGE),
+    ('Bus_2_0', 'vm_pu', 'voltage in p.u.', 'voltage_levels_bus2', BINS_BUS_VOLTAGE),
+    ('LV_Line_0-1_0', 'loading_percent', 'line loading in %', 'loadings_line1', BINS_LINE_LOADING),
+    ('LV_Line_1-2_0', 'loading_percent', 'line loading in %', 'loadings_line2', BINS_LINE_LOADING),
+    ('StratifiedWaterStorageTank_0', 'T_avg', 'average temperature in °C', 'tank_temperature_avg', BINS_TANK_TEMPERATURE_AVG),
+    ('StratifiedWaterStorageTank_0', 'T_hot', 'maximum temperature in °C', 'tank_temperature_max', BINS_TANK_TEMPERATURE_MAX),
+    ('heatpump_0', 'P_effective', 'heat generation in kW', 'heat_pump_power', BINS_HP_POWER_CONSUMPTION),
 ]
 
-BINS_LINE_LOADING = [
-    round(i*5, 2) for i in range(30)
-]
+SHOW_PLOTS = False
 
-BINS_TANK_TEMPERATURE_AVG = [
-    round(50 + i*.25, 2) for i in range(40)
-]
+FIG_TYPE = 'png' # 'pdf'
 
-BINS_TANK_TEMPERATURE_MAX = [
-    round(64 + i*.25, 2) for i in range(40)
-]
+FIG_SIZE = [10, 4]
 
-BINS_HP_POWER_CONSUMPTION = [
-    round(i*5, 2) for i in range(22)
-]
+# Reduce time series to the minimum and maximum per pixel column before plotting.
+PLOT_DECIMATION = True
 
-SHOW_PLOTS = False
+# Fractions of time at which the duration curves of grouped runs are evaluated.
+COMPARE_CURVE_POINTS = np.linspace(0., 1., 1001)
 
-FIG_TYPE = 'png' # 'pdf'
+# Number of processes for rendering the figures (None: number of CPUs, 1: no parallel rendering).
+PLOT_WORKERS = None
+
+# Results loaded by a plotting process (results directory -> results dict).
+_shared_results = {}
 
-FIG_SIZE = [10, 4]
+
+def get_result_names(
+    plot_dict, compare_plots
+):
+    '''
+    Names ('entity.attr') of all results needed for the plots.
+    '''
+    names = [v for (ylabel, variables) in plot_dict.values() for v in variables]
+    names += ['{}.{}'.format(entity, attr) for (entity, attr, *_) in compare_plots]
+    return list(dict.fromkeys(names))
 
 
-def get_sim_node_name(
-    full_name
+def get_plot_width(
 ):
-    (sim_name, sim_node) = full_name.split('.')
-    return sim_node
+    '''
+    Width of the figures in pixels.
+    '''
+    return int(FIG_SIZE[0] * plt.rcParams['figure.dpi'])
 
 
-def retrieve_results(
-    store_name,
-    start_time,
-    drop_first_days_data = True
+def decimate_minmax(
+    data, n_buckets
 ):
-    results_dict = {}
-    results_store = pd.HDFStore(store_name)
+    '''
+    Reduce a series to the minimum and the maximum of each of n_buckets consecutive buckets
+    (in their original order). For a line plot with n_buckets pixel columns, this preserves
+    the envelope of the data.
+    '''
+    n = len(data)
+    if not PLOT_DECIMATION or n <= 2 * n_buckets:
+        return data
 
-    for collector in results_store:
-        for (simulator, attribute), data in results_store[collector].items():
-            # Retrieve short name of data.
-            sim_node_name = get_sim_node_name(simulator)
-            res_name = '.'.join([sim_node_name, attribute])
+    bucket_size = -(-n // n_buckets)
+    n_buckets = -(-n // bucket_size)
 
-            # Convert index to time format.
-            data.index = pd.to_datetime(data.index, unit = 's', origin = start_time)
+    # Pad to full buckets, ignore missing values.
+    values = np.full(n_buckets * bucket_size, np.nan)
+    values[:n] = data.to_numpy(dtype = np.float64)
+    values = values.reshape(n_buckets, bucket_size)
+    offsets = np.arange(n_buckets) * bucket_size
 
-            if drop_first_days_data:
-                first_days_data = data.first('2D')
-                results_dict[res_name] = data.drop(first_days_data.index)
-            else:
-                results_dict[res_name] = data
+    positions_min = offsets + np.argmin(np.where(np.isnan(values), np.inf, values), axis = 1)
+    positions_max = offsets + np.argmax(np.where(np.isnan(values), -np.inf, values), axis = 1)
+    positions = np.unique(np.concatenate((positions_min, positions_max, [0, n - 1])))
 
-    results_store.close()
-    return results_dict
+    return data.iloc[positions[positions < n]]
 
 
 def plot_results_single_run(
@@ -156,7 +176,7 @@ def plot_results_single_run(
         # fig.tight_layout()
         fmt = '.-' if 'controller' in title else '-'
         for v in variables:
-            axes.plot(results_dict[v], fmt, label=v)
+            axes.plot(decimate_minmax(results_dict[v], get_plot_width()), fmt, label=v)
             axes.legend(loc = 'upper right')
             axes.set_title(title)
             axes.set_xlabel('date')
@@ -180,8 +200,8 @@ def plot_results_compare(
     sorted_attr_type2 = attr_type2.sort_values(ascending = False, ignore_index = True)
 
     fig, axes_attr_compare = plt.subplots(figsize = FIG_SIZE)
-    axes_attr_compare.plot(attr_type1, label = '{} {}'.format(entity, label_type1))
-    axes_attr_compare.plot(attr_type2, label = '{} {}'.format(entity, label_type2))
+    axes_attr_compare.plot(decimate_minmax(attr_type1, get_plot_width()), label = '{} {}'.format(entity, label_type1))
+    axes_attr_compare.plot(decimate_minmax(attr_type2, get_plot_width()), label = '{} {}'.format(entity, label_type2))
     axes_attr_compare.legend(loc = 'upper right')
     axes_attr_compare.set_xlabel('date')
     axes_attr_compare.set_ylabel(label)
@@ -192,8 +212,8 @@ def plot_results_compare(
     plt.close()
 
     fig, axes_sorted_attr_compare = plt.subplots(figsize = FIG_SIZE)
-    axes_sorted_attr_compare.plot(sorted_attr_type1, label = '{} {}'.format(entity, label_type1))
-    axes_sorted_attr_compare.plot(sorted_attr_type2, label = '{} {}'.format(entity, label_type2))
+    axes_sorted_attr_compare.plot(decimate_minmax(sorted_attr_type1, get_plot_width()), label = '{} {}'.format(entity, label_type1))
+    axes_sorted_attr_compare.plot(decimate_minmax(sorted_attr_type2, get_plot_width()), label = '{} {}'.format(entity, label_type2))
     axes_sorted_attr_compare.legend(loc = 'upper right')
     axes_sorted_attr_compare.set_ylabel(label)
     axes_sorted_attr_compare.set_title('duration plot of {}'.format(attr))
@@ -215,83 +235,254 @@ def plot_results_compare(
     return (attr_type1.sum(), attr_type2.sum())
 
 
-if __name__ == '__main__':
-    # Retrieve results for simulation with voltage control enabled.
-    dict_results_ctrl_enabled = retrieve_results(
-        'benchmark_results_ctrl_enabled.h5',
-        START_TIME, DROP_FIRST_DAYS_DATA
-        )
+def plot_results_compare_groups(
+    entity, attr, label,
+    result_stats, points,
+    fig_id, bins, show = False, fig_type = 'png'
+):
+    '''
+    Compare the aggregated results of groups of runs (result_stats: group -> statistics of
+    the result, see add_run_statistics): mean duration curve (with the range of all runs of
+    the group) and mean histogram per run of each group.
+    '''
+    fig, axes_sorted_attr_compare = plt.subplots(figsize = FIG_SIZE)
+    for (group, stats) in result_stats.items():
+        lines = axes_sorted_attr_compare.plot(
+            100 * points, stats['curve_sum'] / stats['runs'], label = '{} {}'.format(entity, group)
+            )
+        if stats['runs'] > 1:
+            axes_sorted_attr_compare.fill_between(
+                100 * points, stats['curve_min'], stats['curve_max'], color = lines[0].get_color(), alpha = 0.2
+                )
+    axes_sorted_attr_compare.legend(loc = 'upper right')
+    axes_sorted_attr_compare.set_xlabel('fraction of time in %')
+    axes_sorted_attr_compare.set_ylabel(label)
+    axes_sorted_attr_compare.set_title('duration plot of {}'.format(attr))
+    plt.savefig('fig_sorted_{}.{}'.format(fig_id,fig_type))
+    if show == True:
+        plt.show()
+    plt.close()
 
-    # Retrieve results for simulation with voltage control disabled.
-    dict_results_ctrl_disabled = retrieve_results(
-        'benchmark_results_ctrl_disabled.h5',
-        START_TIME, DROP_FIRST_DAYS_DATA
-        )
+    fig, axes_attr_compare_hist = plt.subplots(figsize = FIG_SIZE)
+    for (group, stats) in result_stats.items():
+        axes_attr_compare_hist.hist(
+            bins[:-1], bins = bins, weights = stats['counts'] / stats['runs'],
+            histtype = 'step', label = '{} {}'.format(entity, group)
+            )
+    axes_attr_compare_hist.legend(loc = 'upper right')
+    axes_attr_compare_hist.set_xlabel(label)
+    axes_attr_compare_hist.set_ylabel('frequency per run')
+    plt.savefig('fig_hist_{}.{}'.format(fig_id,fig_type))
+    if show == True:
+        plt.show()
+    plt.close()
 
-    # Plot results for simulation with voltage control enabled.
-    plot_results_single_run(
-        dict_results_ctrl_enabled, PLOT_DICT,
-        'ts_ctrl_enabled', SHOW_PLOTS, FIG_TYPE
-        )
 
-    # Plot results for simulation with voltage control enabled.
-    plot_results_single_run(
-        dict_results_ctrl_disabled, PLOT_DICT,
-        'ts_ctrl_disabled', SHOW_PLOTS, FIG_TYPE
-        )
+def share_results(
+    results_dict, results_dir
+):
+    '''
+    Store results (with a common time index) as memory-mapped arrays in the given directory,
+    such that they can be used by the plotting processes without copying.
+    '''
+    import pathlib
 
-    # Compare voltage levels for bus 1.
-    plot_results_compare(
-        'Bus_1_0', 'vm_pu', 'voltage in p.u.',
-        'ctrl disabled', dict_results_ctrl_disabled,
-        'ctrl enabled', dict_results_ctrl_enabled,
-        'voltage_levels_bus1', BINS_BUS_VOLTAGE, SHOW_PLOTS, FIG_TYPE
-        )
+    results_dir = pathlib.Path(results_dir)
+    results_dir.mkdir(parents = True, exist_ok = True)
 
-    # Compare voltage levels for bus 2.
-    plot_results_compare(
-        'Bus_2_0', 'vm_pu', 'voltage in p.u.',
-        'ctrl disabled', dict_results_ctrl_disabled,
-        'ctrl enabled', dict_results_ctrl_enabled,
-        'voltage_levels_bus2', BINS_BUS_VOLTAGE, SHOW_PLOTS, FIG_TYPE
-        )
+    data = pd.DataFrame(results_dict)
+    np.save(results_dir / 'index.npy', data.index.values)
+    np.save(results_dir / 'values.npy', np.asfortranarray(data.to_numpy(dtype = np.float64)))
+    pd.Series(data.columns).to_json(results_dir / 'names.json')
 
-    # Compare line loadings for line 1.
-    plot_results_compare(
-        'LV_Line_0-1_0', 'loading_percent', 'line loading in %',
-        'ctrl disabled', dict_results_ctrl_disabled,
-        'ctrl enabled', dict_results_ctrl_enabled,
-        'loadings_line1', BINS_LINE_LOADING, SHOW_PLOTS, FIG_TYPE
-        )
+    return str(results_dir)
 
-    # Compare line loadings for line 2.
-    plot_results_compare(
-        'LV_Line_1-2_0', 'loading_percent', 'line loading in %',
-        'ctrl disabled', dict_results_ctrl_disabled,
-        'ctrl enabled', dict_results_ctrl_enabled,
-        'loadings_line2', BINS_LINE_LOADING, SHOW_PLOTS, FIG_TYPE
-        )
 
-    # Average tank temperature.
-    plot_results_compare(
-        'StratifiedWaterStorageTank_0', 'T_avg', 'average temperature in °C',
-        'ctrl disabled', dict_results_ctrl_disabled,
-        'ctrl enabled', dict_results_ctrl_enabled,
-        'tank_temperature_avg', BINS_TANK_TEMPERATURE_AVG, SHOW_PLOTS, FIG_TYPE
-        )
+def load_shared_results(
+    results_dir
+):
+    '''
+    Results stored with share_results (memory-mapped, loaded once per process).
+    '''
+    import pathlib
+
+    if results_dir not in _shared_results:
+        path = pathlib.Path(results_dir)
+        index = pd.DatetimeIndex(np.load(path / 'index.npy'))
+        values = np.load(path / 'values.npy', mmap_mode = 'r')
+        names = pd.read_json(path / 'names.json', typ = 'series').tolist()
+        _shared_results[results_dir] = {
+            name: pd.Series(values[:, i], index = index, copy = False) for i, name in enumerate(names)
+        }
 
-    # Maximum tank temperature.
-    plot_results_compare(
-        'StratifiedWaterStorageTank_0', 'T_hot', 'maximum temperature in °C',
-        'ctrl disabled', dict_results_ctrl_disabled,
-        'ctrl enabled', dict_results_ctrl_enabled,
-        'tank_temperature_max', BINS_TANK_TEMPERATURE_MAX, SHOW_PLOTS, FIG_TYPE
+    return _shared_results[results_dir]
+
+
+def render_figure(
+    job
+):
+    '''
+    Render the figures of a job ('single', results directory, plot dict, fig id, fig type),
+    ('compare', entity, attr, label, label type 1, results directory 1, label type 2,
+    results directory 2, fig id, bins, fig type) or ('groups', entity, attr, label,
+    statistics of the result per group, points, fig id, bins, fig type).
+    '''
+    if job[0] == 'single':
+        (_, results_dir, plot_dict, fig_id, fig_type) = job
+        return plot_results_single_run(
+            load_shared_results(results_dir), plot_dict, fig_id, False, fig_type
+            )
+
+    if job[0] == 'groups':
+        (_, entity, attr, label, result_stats, points, fig_id, bins, fig_type) = job
+        return plot_results_compare_groups(
+            entity, attr, label, result_stats, points, fig_id, bins, False, fig_type
+            )
+
+    (_, entity, attr, label, label_type1, results_dir1, label_type2, results_dir2, fig_id, bins, fig_type) = job
+    return plot_results_compare(
+        entity, attr, label,
+        label_type1, load_shared_results(results_dir1),
+        label_type2, load_shared_results(results_dir2),
+        fig_id, bins, False, fig_type
         )
 
-    # Compare power consumption of heat pump.
-    plot_results_compare(
-        'heatpump_0', 'P_effective', 'heat generation in kW',
-        'ctrl disabled', dict_results_ctrl_disabled,
-        'ctrl enabled', dict_results_ctrl_enabled,
-        'heat_pump_power', BINS_HP_POWER_CONSUMPTION, SHOW_PLOTS, FIG_TYPE
+
+def _init_plot_worker():
+    plt.switch_backend('Agg')
+
+
+def render_figures(
+    jobs, max_workers = None
+):
+    '''
+    Render the figures of all jobs in a pool of processes (Agg backend).
+    :return: list of the return values of the jobs
+    '''
+    if max_workers == 1:
+        _init_plot_worker()
+        return [render_figure(job) for job in jobs]
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers = max_workers, initializer = _init_plot_worker) as executor:
+        return list(executor.map(render_figure, jobs))
+
+
+def compare_groups(
+    store_names, group_by = None, outfile_prefix = 'compare',
+    show = False, fig_type = 'png'
+):
+    '''
+    Compare any number of runs (single runs or sweeps), grouped by scenario parameters. The
+    runs are read one at a time, only their KPIs and the histograms and duration curves of
+    COMPARE_PLOTS aggregated per group are kept in memory.
+    '''
+    bins_dict = {'{}.{}'.format(entity, attr): bins for (entity, attr, label, fig_id, bins) in COMPARE_PLOTS}
+
+    (summary, group_stats) = aggregate_stores(
+        store_names, bins_dict, COMPARE_CURVE_POINTS, group_by,
+        START_TIME, DROP_FIRST_DAYS_DATA
         )
+    write_group_kpis(summary, group_stats, bins_dict, COMPARE_CURVE_POINTS, outfile_prefix)
+
+    jobs = []
+    for (entity, attr, label, fig_id, bins) in COMPARE_PLOTS:
+        res_name = '{}.{}'.format(entity, attr)
+        jobs.append((
+            'groups', entity, attr, label,
+            {group: stats['results'][res_name] for (group, stats) in group_stats.items() if res_name in stats['results']},
+            COMPARE_CURVE_POINTS, '{}_{}'.format(outfile_prefix, fig_id), bins, fig_type
+            ))
+
+    if show:
+        for job in jobs:
+            (_, entity, attr, label, stats, points, fig_id, bins, fig_type) = job
+            plot_results_compare_groups(entity, attr, label, stats, points, fig_id, bins, True, fig_type)
+    else:
+        render_figures(jobs, PLOT_WORKERS)
+
+    return summary
+
+
+if __name__ == '__main__':
+    import argparse
+    import tempfile
+
+    # Parse command line options.
+    parser = argparse.ArgumentParser()
+    parser.add_argument('stores', nargs = '*', help = 'results files to compare (single runs or sweeps), default: '
+                        'compare benchmark_results_ctrl_enabled.h5 and benchmark_results_ctrl_disabled.h5')
+    parser.add_argument('--group-by', nargs = '+', default = None, help = 'group the scenarios of sweeps by these parameters (default: one group per run)')
+    parser.add_argument('--outfile-prefix', default = 'compare', help = 'prefix of the KPI files and figures of the comparison')
+    args = parser.parse_args()
+
+    if args.stores:
+        # Compare any number of runs, grouped by scenario parameters.
+        compare_groups(args.stores, args.group_by, args.outfile_prefix, SHOW_PLOTS, FIG_TYPE)
+
+    else:
+        result_names = get_result_names(PLOT_DICT, COMPARE_PLOTS)
+
+        # Retrieve results for simulation with voltage control enabled.
+        dict_results_ctrl_enabled = retrieve_results(
+            'benchmark_results_ctrl_enabled.h5',
+            START_TIME, DROP_FIRST_DAYS_DATA, result_names
+            )
+
+        # Retrieve results for simulation with voltage control disabled.
+        dict_results_ctrl_disabled = retrieve_results(
+            'benchmark_results_ctrl_disabled.h5',
+            START_TIME, DROP_FIRST_DAYS_DATA, result_names
+            )
+
+        # KPIs of both simulations (written to benchmark_kpis_*.csv).
+        write_kpis(
+            compute_kpis({'ctrl disabled': dict_results_ctrl_disabled, 'ctrl enabled': dict_results_ctrl_enabled}),
+            'benchmark_kpis'
+            )
+
+        if SHOW_PLOTS:
+            # Plot results for simulation with voltage control enabled.
+            plot_results_single_run(
+                dict_results_ctrl_enabled, PLOT_DICT,
+                'ts_ctrl_enabled', SHOW_PLOTS, FIG_TYPE
+                )
+
+            # Plot results for simulation with voltage control disabled.
+            plot_results_single_run(
+                dict_results_ctrl_disabled, PLOT_DICT,
+                'ts_ctrl_disabled', SHOW_PLOTS, FIG_TYPE
+                )
+
+            # Compare voltage levels, line loadings, tank temperatures and power consumption of heat pump.
+            for (entity, attr, label, fig_id, bins) in COMPARE_PLOTS:
+                plot_results_compare(
+                    entity, attr, label,
+                    'ctrl disabled', dict_results_ctrl_disabled,
+                    'ctrl enabled', dict_results_ctrl_enabled,
+                    fig_id, bins, SHOW_PLOTS, FIG_TYPE
+                    )
+
+        else:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                # Share the results with the plotting processes.
+                results_ctrl_enabled = share_results(dict_results_ctrl_enabled, tmp_dir + '/ctrl_enabled')
+                results_ctrl_disabled = share_results(dict_results_ctrl_disabled, tmp_dir + '/ctrl_disabled')
+
+                # Time series plots (one job per figure).
+                jobs = []
+                for (results_dir, fig_id) in [(results_ctrl_enabled, 'ts_ctrl_enabled'), (results_ctrl_disabled, 'ts_ctrl_disabled')]:
+                    for (title, plot) in PLOT_DICT.items():
+                        jobs.append(('single', results_dir, {title: plot}, fig_id, FIG_TYPE))
+
+                # Comparison plots.
+                for (entity, attr, label, fig_id, bins) in COMPARE_PLOTS:
+                    jobs.append((
+                        'compare', entity, attr, label,
+                        'ctrl disabled', results_ctrl_disabled,
+                        'ctrl enabled', results_ctrl_enabled,
+                        fig_id, bins, FIG_TYPE
+                        ))
+
+                render_figures(jobs, PLOT_WORKERS)
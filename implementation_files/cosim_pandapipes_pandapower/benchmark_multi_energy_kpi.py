@@ -0,0 +1,610 @@
+'''
+Key performance indicators (KPIs) of the benchmark results, computed without plotting.
+
+The results of several runs are stacked into 2-D arrays (one row per run, padded with NaN)
+and every KPI is evaluated for all runs at once. Runs are read and evaluated in batches, such
+that the results of large parameter sweeps can be evaluated with bounded memory. For
+comparisons of many runs, aggregate_stores streams the runs one at a time and only keeps
+their histograms and duration curves aggregated per group.
+
+Results can be read from HDF5 stores (single runs or sweeps) and from Parquet datasets
+written with output format 'parquet' (directories, one run per scenario).
+'''
+
+import numpy as np
+import pandas as pd
+
+START_TIME = '2019-02-01 00:00:00'
+
+DROP_FIRST_DAYS_DATA = True
+
+BINS_BUS_VOLTAGE = [
+    round(0.75 + i*.01, 2) for i in range(46)
+]
+
+BINS_LINE_LOADING = [
+    round(i*5, 2) for i in range(30)
+]
+
+BINS_TANK_TEMPERATURE_AVG = [
+    round(50 + i*.25, 2) for i in range(40)
+]
+
+BINS_TANK_TEMPERATURE_MAX = [
+    round(64 + i*.25, 2) for i in range(40)
+]
+
+BINS_HP_POWER_CONSUMPTION = [
+    round(i*5, 2) for i in range(22)
+]
+
+# Voltage band in p.u. (limits of the voltage controller for switching the heat pump).
+VOLTAGE_BAND = (0.9, 1.1)
+
+# Line loading limit in %.
+LINE_LOADING_LIMIT = 100.
+
+# Electrical power of the heat pump in kW, on if above the threshold (standby consumption is 0.3 kW).
+HP_POWER = 'heatpump_0.P_effective'
+HP_ON_THRESHOLD = 1.
+
+# Results with duration curves, evaluated at these fractions of time.
+DURATION_CURVES = [
+    'StratifiedWaterStorageTank_0.T_avg',
+    'StratifiedWaterStorageTank_0.T_hot',
+]
+DURATION_CURVE_POINTS = np.linspace(0., 1., 101)
+
+# Bins of the histograms (attribute -> bins), for all results with these attributes.
+HISTOGRAM_BINS = {
+    'vm_pu': BINS_BUS_VOLTAGE,
+    'loading_percent': BINS_LINE_LOADING,
+    'T_avg': BINS_TANK_TEMPERATURE_AVG,
+    'T_hot': BINS_TANK_TEMPERATURE_MAX,
+    'P_effective': BINS_HP_POWER_CONSUMPTION,
+}
+
+# Number of runs read and evaluated at once.
+BATCH_SIZE = 64
+
+
+def get_sim_node_name(
+    full_name
+):
+    (sim_name, sim_node) = full_name.split('.')
+    return sim_node
+
+
+def is_parquet_dataset(
+    store_name
+):
+    '''
+    Check if the results are a Parquet dataset (a directory) instead of an HDF5 store.
+    '''
+    import pathlib
+
+    return pathlib.Path(store_name).is_dir()
+
+
+def select_results(
+    columns, names
+):
+    '''
+    Columns (simulator, attribute) of the results with the given names (see retrieve_results),
+    as dict column -> result name ('entity.attr').
+    '''
+    selected = {}
+    for column in columns:
+        if not isinstance(column, tuple) or len(column) != 2:
+            continue
+        (simulator, attribute) = column
+        res_name = '.'.join([get_sim_node_name(simulator), attribute])
+        if names is None or (names(res_name) if callable(names) else res_name in names):
+            selected[column] = res_name
+    return selected
+
+
+def set_time_index(
+    data, start_time, drop_first_days_data
+):
+    '''
+    Convert the index of a frame (simulation time in seconds) to time format, optionally
+    dropping the data of the first two simulated days.
+    '''
+    seconds = data.index.values
+    if drop_first_days_data and len(seconds):
+        # Drop the data of the first two simulated days.
+        data = data.iloc[seconds.searchsorted(seconds[0] + 2 * 24 * 60 * 60):]
+    data.index = pd.to_datetime(data.index, unit = 's', origin = start_time)
+    return data
+
+
+def retrieve_parquet_results(
+    root,
+    start_time,
+    drop_first_days_data = True,
+    names = None,
+    scenarios = None
+):
+    '''
+    Read results from a Parquet dataset (see retrieve_results), one scenario at a time. Only
+    the scenarios with the given ids are read (default: all), the results of several scenarios
+    are concatenated in time.
+    '''
+    import pathlib
+    import pyarrow.parquet as pq
+    from simulators.collector import read_parquet_results
+
+    results_dict = {}
+    for scenario in (list_parquet_scenarios(root) if scenarios is None else scenarios):
+        # Columns of the scenario (without reading the data).
+        part = next(pathlib.Path(root, 'results', 'scenario={}'.format(scenario)).glob('day=*/*.parquet'))
+        columns = [tuple(name.rsplit('.', 1)) for name in pq.read_schema(part).names if name != 'time']
+
+        selected = select_results(columns, names)
+        if not selected:
+            continue
+
+        data = read_parquet_results(root, columns = ['.'.join(column) for column in selected], scenarios = [scenario])
+        data = set_time_index(data.droplevel('scenario'), start_time, drop_first_days_data)
+
+        for column, res_name in selected.items():
+            results_dict[res_name] = pd.concat([results_dict[res_name], data[column]]) if res_name in results_dict else data[column]
+
+    return results_dict
+
+
+def retrieve_results(
+    store_name,
+    start_time,
+    drop_first_days_data = True,
+    names = None,
+    keys = None
+):
+    '''
+    Read results from a store. Only the results with the given names ('entity.attr') are
+    read (default: all), names can also be a function returning True for the names to read.
+    Only the frames with the given keys are read (default: all). All results of a frame share
+    the same time index. For Parquet datasets, the keys are scenario ids (see
+    retrieve_parquet_results).
+    '''
+    if is_parquet_dataset(store_name):
+        return retrieve_parquet_results(store_name, start_time, drop_first_days_data, names, keys)
+
+    results_dict = {}
+    results_store = pd.HDFStore(store_name, 'r')
+
+    for collector in (results_store.keys() if keys is None else keys):
+        storer = results_store.get_storer(collector)
+
+        # Columns of the frame (without reading the data, if stored as table).
+        if storer.is_table:
+            columns = storer.non_index_axes[0][1]
+        else:
+            data = results_store[collector]
+            columns = list(data.columns)
+
+        selected = select_results(columns, names)
+        if not selected:
+            continue
+
+        if storer.is_table:
+            data = results_store.select(collector, columns = list(selected))
+        else:
+            data = data[list(selected)]
+
+        # Convert index to time format (once for all results of the frame).
+        data = set_time_index(data, start_time, drop_first_days_data)
+
+        for column, res_name in selected.items():
+            results_dict[res_name] = data[column]
+
+    results_store.close()
+    return results_dict
+
+
+def list_parquet_scenarios(
+    root
+):
+    '''
+    Ids of the scenarios in a Parquet dataset.
+    '''
+    import pathlib
+
+    return sorted(path.name.split('=', 1)[1] for path in pathlib.Path(root, 'results').glob('scenario=*'))
+
+
+def list_runs(
+    store_name
+):
+    '''
+    Runs in a store, as list of (run name, keys). The results of a sweep (frames
+    "<scenario id>/results") are one run per scenario, otherwise the store is a single run
+    named after the file. In Parquet datasets, each scenario is a run (keys: scenario id),
+    a single run with the default scenario id is named after the directory.
+    '''
+    import pathlib
+
+    if is_parquet_dataset(store_name):
+        scenarios = list_parquet_scenarios(store_name)
+        if scenarios == ['default']:
+            return [(pathlib.Path(store_name).name, scenarios)]
+        return [(scenario, [scenario]) for scenario in scenarios]
+
+    with pd.HDFStore(store_name, 'r') as store:
+        keys = store.keys()
+
+    runs = [(key.split('/')[1], [key]) for key in keys if key.count('/') == 2 and key.endswith('/results')]
+    if runs:
+        return runs
+
+    return [(pathlib.Path(store_name).stem, None)]
+
+
+def get_run_name(
+    store_name, run_name, store_names
+):
+    '''
+    Name of a run in the evaluation of the given stores: for several stores, the run name is
+    qualified with its store ("<store>:<run>"), such that runs of different stores are distinct.
+    '''
+    return run_name if len(store_names) == 1 else '{}:{}'.format(store_name, run_name)
+
+
+def is_kpi_result(
+    res_name
+):
+    '''
+    Check if a result ('entity.attr') is needed for the KPIs.
+    '''
+    attribute = res_name.split('.')[-1]
+    return attribute in HISTOGRAM_BINS or res_name in DURATION_CURVES or res_name == HP_POWER
+
+
+def stack_runs(
+    runs, res_name
+):
+    '''
+    Values of a result for all runs, one row per run (padded with NaN), and the duration in
+    seconds that each value is valid (until the next time step, padded with 0). The last value
+    of a run is valid for the median time step of the run.
+    '''
+    n = max(max(len(results[res_name]) for results in runs), 1)
+    values = np.full((len(runs), n), np.nan)
+    durations = np.zeros((len(runs), n))
+
+    for i, results in enumerate(runs):
+        series = results[res_name]
+        if len(series) == 0:
+            continue
+        seconds = series.index.values.astype('datetime64[ns]').astype(np.int64) * 1e-9
+        values[i, :len(series)] = series.to_numpy(dtype = np.float64)
+        durations[i, :len(series) - 1] = np.diff(seconds)
+        durations[i, len(series) - 1] = np.median(np.diff(seconds)) if len(series) > 1 else 0.
+
+    return values, durations
+
+
+def time_outside_band(
+    values, durations, lower, upper
+):
+    '''
+    Time in minutes with values outside the band (lower, upper), per run.
+    '''
+    outside = (values < lower) | (values > upper)
+    return np.sum(np.where(outside, durations, 0.), axis = 1) / 60.
+
+
+def overload_energy(
+    values, durations, limit
+):
+    '''
+    Integral of the values above the limit over time in hours, per run.
+    '''
+    excess = np.clip(np.nan_to_num(values - limit, nan = 0.), 0., None)
+    return np.sum(excess * durations, axis = 1) / 3600.
+
+
+def energy(
+    values, durations
+):
+    '''
+    Integral of the values over time in hours (e.g., kWh for values in kW), per run.
+    '''
+    return np.sum(np.nan_to_num(values) * durations, axis = 1) / 3600.
+
+
+def count_starts(
+    values, threshold
+):
+    '''
+    Number of transitions from values below or at the threshold to values above it, per run.
+    '''
+    on = values > threshold
+    return np.sum(on[:, 1:] & ~on[:, :-1], axis = 1)
+
+
+def duration_curves(
+    values, points
+):
+    '''
+    Duration curves (values sorted in descending order) evaluated at the given fractions of
+    time, one row per run.
+    '''
+    # Sort in descending order, missing values last.
+    sorted_values = -np.sort(-values, axis = 1)
+    n_valid = np.sum(~np.isnan(values), axis = 1)
+
+    positions = np.floor(np.outer(np.maximum(n_valid - 1, 0), points) + 0.5).astype(np.int64)
+    curves = np.take_along_axis(sorted_values, positions, axis = 1)
+    curves[n_valid == 0] = np.nan
+    return curves
+
+
+def histograms(
+    values, bins
+):
+    '''
+    Histogram counts of the values for all runs (same bins as numpy.histogram), one row per run.
+    '''
+    bins = np.asarray(bins, dtype = np.float64)
+    n_bins = len(bins) - 1
+
+    # The last bin includes its right edge.
+    index = np.searchsorted(bins, values, side = 'right') - 1
+    index[values == bins[-1]] = n_bins - 1
+    valid = (index >= 0) & (index < n_bins) & ~np.isnan(values)
+
+    rows = np.broadcast_to(np.arange(len(values))[:, None], values.shape)
+    return np.bincount(
+        (rows[valid] * n_bins + index[valid]), minlength = len(values) * n_bins
+        ).reshape(len(values), n_bins)
+
+
+def compute_kpis(
+    runs
+):
+    '''
+    KPIs of several runs (dict run name -> results dict). Only results available in all runs
+    are evaluated.
+    :return: tuple (summary, histogram counts, duration curves) as data frames, with one
+        column per run (summary: one row per run)
+    '''
+    run_names = list(runs)
+    run_results = list(runs.values())
+    res_names = [name for name in run_results[0] if all(name in results for results in run_results)]
+
+    summary = {}
+    hists = {}
+    curves = {}
+
+    for res_name in res_names:
+        (entity, attribute) = res_name.split('.')
+        if not is_kpi_result(res_name):
+            continue
+
+        values, durations = stack_runs(run_results, res_name)
+
+        if attribute == 'vm_pu' and entity.startswith('Bus'):
+            summary['{}.voltage_violation_min'.format(entity)] = time_outside_band(values, durations, *VOLTAGE_BAND)
+            summary['{}.vm_pu_min'.format(entity)] = np.fmin.reduce(values, axis = 1)
+            summary['{}.vm_pu_max'.format(entity)] = np.fmax.reduce(values, axis = 1)
+
+        if attribute == 'loading_percent':
+            summary['{}.overload_percent_h'.format(entity)] = overload_energy(values, durations, LINE_LOADING_LIMIT)
+            summary['{}.loading_percent_max'.format(entity)] = np.fmax.reduce(values, axis = 1)
+
+        if res_name == HP_POWER:
+            summary['{}.energy_kwh'.format(entity)] = energy(values, durations)
+            summary['{}.starts'.format(entity)] = count_starts(values, HP_ON_THRESHOLD)
+
+        if res_name in DURATION_CURVES:
+            for (point, curve) in zip(DURATION_CURVE_POINTS, duration_curves(values, DURATION_CURVE_POINTS).T):
+                curves[(res_name, round(point, 6))] = curve
+
+        if attribute in HISTOGRAM_BINS:
+            bins = HISTOGRAM_BINS[attribute]
+            for (left, counts) in zip(bins[:-1], histograms(values, bins).T):
+                hists[(res_name, left)] = counts
+
+    df_summary = pd.DataFrame(summary, index = pd.Index(run_names, name = 'run'))
+    df_hists = pd.DataFrame(hists, index = run_names).T.rename_axis(['result', 'bin_left'])
+    df_curves = pd.DataFrame(curves, index = run_names).T.rename_axis(['result', 'fraction_of_time'])
+
+    return df_summary, df_hists, df_curves
+
+
+def evaluate_stores(
+    store_names, start_time = START_TIME, drop_first_days_data = DROP_FIRST_DAYS_DATA,
+    batch_size = BATCH_SIZE
+):
+    '''
+    KPIs of all runs in the given stores (see list_runs), evaluated in batches of runs. For
+    several stores, the runs are named "<store>:<run>".
+    :return: tuple (summary, histogram counts, duration curves), see compute_kpis
+    '''
+    all_runs = [
+        (store_name, get_run_name(store_name, run_name, store_names), keys)
+        for store_name in store_names for (run_name, keys) in list_runs(store_name)
+    ]
+
+    kpis = []
+    for i in range(0, len(all_runs), batch_size):
+        runs = {}
+        for (store_name, run_name, keys) in all_runs[i:i + batch_size]:
+            runs[run_name] = retrieve_results(store_name, start_time, drop_first_days_data, is_kpi_result, keys)
+        kpis.append(compute_kpis(runs))
+
+    return tuple(pd.concat(frames, axis = axis) for (frames, axis) in zip(zip(*kpis), [0, 1, 1]))
+
+
+def read_scenario_params(
+    store_name
+):
+    '''
+    Parameters of the scenarios of a sweep (data frame indexed by scenario id), None if the
+    store contains a single run.
+    '''
+    if is_parquet_dataset(store_name):
+        from simulators.collector import read_scenario_params as read_parquet_scenario_params
+
+        params = read_parquet_scenario_params(store_name)
+        if list(params) == ['default']:
+            return None
+        return pd.DataFrame.from_dict(params, orient = 'index').drop(columns = 'scenario_id', errors = 'ignore')
+
+    with pd.HDFStore(store_name, 'r') as store:
+        if '/scenarios' not in store.keys():
+            return None
+        return store['scenarios']
+
+
+def get_group_name(
+    run_name, params, group_by
+):
+    '''
+    Name of the group of a run: the values of the parameters group_by (if available for the
+    run), otherwise the name of the run.
+    '''
+    if not group_by or params is None or not all(name in params for name in group_by):
+        return run_name
+    return ', '.join('{}={}'.format(name, params[name]) for name in group_by)
+
+
+def add_run_statistics(
+    group_stats, results, bins_dict, points
+):
+    '''
+    Add the histograms and duration curves of a run to the statistics of its group. The
+    statistics of a group are the number of its runs ('runs') and the statistics per result
+    ('results', dict result name -> statistics): number of runs with the result, histogram
+    counts summed over these runs, and the sum, minimum and maximum of their duration curves
+    (evaluated at the given fractions of time), such that their size does not depend on the
+    number of runs.
+    :param group_stats: statistics of the group (dict, updated)
+    :param results: results dict of the run
+    :param bins_dict: histogram bins of the results to evaluate (name -> bins)
+    '''
+    group_stats['runs'] = group_stats.get('runs', 0) + 1
+    result_stats = group_stats.setdefault('results', {})
+
+    for (res_name, bins) in bins_dict.items():
+        if res_name not in results or results[res_name].count() == 0:
+            continue
+
+        (values, _) = stack_runs([results], res_name)
+        counts = histograms(values, bins)[0]
+        curve = duration_curves(values, points)[0]
+
+        stats = result_stats.setdefault(res_name, {})
+        if not stats:
+            stats.update(runs = 0, counts = np.zeros_like(counts), curve_sum = np.zeros_like(curve),
+                         curve_min = np.full_like(curve, np.inf), curve_max = np.full_like(curve, -np.inf))
+        stats['runs'] += 1
+        stats['counts'] += counts
+        stats['curve_sum'] += curve
+        np.minimum(stats['curve_min'], curve, out = stats['curve_min'])
+        np.maximum(stats['curve_max'], curve, out = stats['curve_max'])
+
+
+def aggregate_stores(
+    store_names, bins_dict, points = DURATION_CURVE_POINTS, group_by = None,
+    start_time = START_TIME, drop_first_days_data = DROP_FIRST_DAYS_DATA
+):
+    '''
+    Stream all runs in the given stores (see list_runs) one at a time, and aggregate their
+    KPIs, histograms and duration curves per group (see get_group_name). For several stores,
+    the runs are named "<store>:<run>" (see get_run_name). Only the results of a single run are
+    in memory at any time.
+    :return: tuple (summary, group statistics), summary has one row per run (see compute_kpis)
+        and a column with the group, group statistics map group names to the statistics of
+        their runs (see add_run_statistics)
+    '''
+    summaries = []
+    group_stats = {}
+    store_names = list(store_names)
+
+    for store_name in store_names:
+        scenarios = read_scenario_params(store_name)
+
+        for (run_name, keys) in list_runs(store_name):
+            params = scenarios.loc[run_name] if scenarios is not None and run_name in scenarios.index else None
+            group = get_group_name(get_run_name(store_name, run_name, store_names), params, group_by)
+
+            results = retrieve_results(
+                store_name, start_time, drop_first_days_data,
+                lambda name: name in bins_dict or is_kpi_result(name), keys
+                )
+
+            summary = compute_kpis({get_run_name(store_name, run_name, store_names): results})[0]
+            summary.insert(0, 'store', store_name)
+            summary.insert(0, 'group', group)
+            summaries.append(summary)
+
+            add_run_statistics(group_stats.setdefault(group, {}), results, bins_dict, points)
+            del results
+
+    return pd.concat(summaries), group_stats
+
+
+def write_group_kpis(
+    summary, group_stats, bins_dict, points, outfile_prefix
+):
+    '''
+    Write the aggregated KPIs to CSV files "<prefix>_runs.csv" (one row per run),
+    "<prefix>_groups.csv" (mean, minimum and maximum per group), "<prefix>_histograms.csv"
+    (counts summed per group) and "<prefix>_duration_curves.csv" (mean per group).
+    '''
+    summary.to_csv('{}_runs.csv'.format(outfile_prefix))
+    summary.drop(columns = 'store').groupby('group', sort = False).agg(['mean', 'min', 'max']).to_csv(
+        '{}_groups.csv'.format(outfile_prefix)
+        )
+
+    hists = {}
+    curves = {}
+    for (group, stats) in group_stats.items():
+        for (res_name, bins) in bins_dict.items():
+            if res_name not in stats['results']:
+                continue
+            result_stats = stats['results'][res_name]
+            for (left, counts) in zip(bins[:-1], result_stats['counts']):
+                hists.setdefault((res_name, left), {})[group] = counts
+            for (point, value) in zip(points, result_stats['curve_sum'] / result_stats['runs']):
+                curves.setdefault((res_name, round(point, 6)), {})[group] = value
+
+    pd.DataFrame(hists, index = list(group_stats)).T.rename_axis(['result', 'bin_left']).to_csv(
+        '{}_histograms.csv'.format(outfile_prefix)
+        )
+    pd.DataFrame(curves, index = list(group_stats)).T.rename_axis(['result', 'fraction_of_time']).to_csv(
+        '{}_duration_curves.csv'.format(outfile_prefix)
+        )
+
+
+def write_kpis(
+    kpis, outfile_prefix
+):
+    '''
+    Write the KPIs to CSV files "<prefix>_summary.csv", "<prefix>_histograms.csv" and
+    "<prefix>_duration_curves.csv".
+    '''
+    (summary, hists, curves) = kpis
+    summary.to_csv('{}_summary.csv'.format(outfile_prefix))
+    hists.to_csv('{}_histograms.csv'.format(outfile_prefix))
+    curves.to_csv('{}_duration_curves.csv'.format(outfile_prefix))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    # Parse command line options.
+    parser = argparse.ArgumentParser()
+    parser.add_argument('stores', nargs = '+', help = 'results files (single runs or sweeps)')
+    parser.add_argument('--outfile-prefix', default = 'benchmark_kpis', help = 'prefix of the KPI files')
+    parser.add_argument('--keep-first-days', action = 'store_true', help = 'include data of the first two simulated days')
+    args = parser.parse_args()
+
+    kpis = evaluate_stores(args.stores, START_TIME, not args.keep_first_days)
+    write_kpis(kpis, args.outfile_prefix)
+
+    with pd.option_context('display.max_columns', None, 'display.width', 200):
+        print(kpis[0])
@@ -14,6 +14,15 @@ HEAT_DEMAND_LOAD_PROFILES = 'resources/heat/heat_demand_load_profiles.csv'
 POWER_DEMAND_LOAD_PROFILES = 'resources/power/power_demand_load_profiles.csv'
 PV_GENERATION_PROFILES = 'resources/power/pv_generation_profiles.csv'
 
+# Number of time steps after which the collected results are appended to the results file.
+H5_FLUSH_STEPS = 24 * 60
+
+# Number of blocks of results that can be queued for the background writer thread.
+H5_WRITER_QUEUE_SIZE = 2
+
+# Collected attributes that are only recorded when they change (absolute tolerance per attribute).
+DELTA_RECORDING = {'state': 0, 'hp_on_request': 0, 'hp_off_request': 0, 'hp_p_el_kw_setpoint': 0}
+
 # MOSAIK simulator configuration.
 SIM_CONFIG = {
     'DHNetworkSim': {
@@ -53,39 +62,73 @@ INIT_HEX_SUPPLY_TEMP = 75  # Return temperature of heat exchanger.
 INIT_HEX_RETURN_TEMP = 45  # Return temperature of heat exchanger.
 INIT_STORAGE_TANK_TEMP = 70  # Storage tank initial temperature.
 
+# Entities with parameters that can be set per scenario (see instantiateEntities).
+SCENARIO_ENTITIES = ['storage_tank', 'heat_pump', 'flex_heat_ctrl', 'voltage_ctrl']
+
 
 def loadProfiles():
     '''
-    Load profiles for demand (heat, power) and PV generation.
+    Load profiles for demand (heat, power) and PV generation. The parsed profiles are cached
+    in binary form (see simulators.time_series_player.profile_cache).
     '''
-    import pandas as pd
     import pathlib
+    from simulators.time_series_player import load_csv_profile
 
     profiles = {}
     
     here = pathlib.Path(__file__).resolve().parent
     
-    profiles['heat_demand'] = pd.read_csv(
-        pathlib.Path(here, HEAT_DEMAND_LOAD_PROFILES),
-        index_col = 0, parse_dates = True
-    )
+    profiles['heat_demand'] = load_csv_profile(pathlib.Path(here, HEAT_DEMAND_LOAD_PROFILES))
 
-    profiles['power_demand'] = pd.read_csv(
-        pathlib.Path(here, POWER_DEMAND_LOAD_PROFILES),
-        index_col = 0, parse_dates = True
-    )
+    profiles['power_demand'] = load_csv_profile(pathlib.Path(here, POWER_DEMAND_LOAD_PROFILES))
 
-    profiles['pv_generation'] = pd.read_csv(
-        pathlib.Path(here, PV_GENERATION_PROFILES),
-        index_col = 0, parse_dates = True
-    )
+    profiles['pv_generation'] = load_csv_profile(pathlib.Path(here, PV_GENERATION_PROFILES))
 
     return profiles
 
 
-def initializeSimulators(world, step_size, outfile_name):
+def scaleProfiles(profiles, profile_scaling = None):
+    '''
+    Scale profiles for demand (heat, power) and PV generation by constant factors.
+    '''
+    if not profile_scaling:
+        return profiles
+
+    return {name: profile * profile_scaling.get(name, 1.) for name, profile in profiles.items()}
+
+
+def checkScenarioParams(params, profile_names):
+    '''
+    Check that the parameters of a scenario only refer to known entities (SCENARIO_ENTITIES)
+    and, for key 'profile_scaling', to known profiles. Raises ValueError otherwise.
+    '''
+    params = params or {}
+
+    unknown = sorted(set(params) - set(SCENARIO_ENTITIES) - {'profile_scaling'})
+    if unknown:
+        raise ValueError('Unknown entities in scenario parameters: {} (known: {}).'.format(
+            ', '.join(unknown), ', '.join(SCENARIO_ENTITIES + ['profile_scaling'])))
+
+    unknown = sorted(set(params.get('profile_scaling') or {}) - set(profile_names))
+    if unknown:
+        raise ValueError('Unknown profiles in profile scaling: {} (known: {}).'.format(
+            ', '.join(unknown), ', '.join(profile_names)))
+
+
+def scenarioParams(params, entity, **default_params):
+    '''
+    Overwrite the default parameters of an entity with the parameters of a scenario.
+    '''
+    if params:
+        default_params.update(params.get(entity, {}))
+    return default_params
+
+
+def initializeSimulators(world, step_size, outfile_name, h5_frame_name = 'results',
+                         output_format = 'h5', scenario_id = 'default', scenario_params = None):
     '''
-    Initialize and start all simulators.
+    Initialize and start all simulators. With output_format 'parquet', the results are written
+    to a Parquet dataset in directory outfile_name (partitioned by scenario and day).
     '''   
     simulators = {}
 
@@ -112,14 +155,16 @@ def initializeSimulators(world, step_size, outfile_name):
     simulators['load_gen_profiles'] = world.start(
         'TimeSeriesSim',
         eid_prefix = 'power_demand',
-        step_size = step_size
+        step_size = step_size,
+        fieldnames = ['Load_1', 'Load_2', 'PV_1', 'PV_2']
     )
 
     # Time series player for the consumer heat demand.
     simulators['heat_profiles'] = world.start(
         'TimeSeriesSim',
         eid_prefix = 'heat_demand',
-        step_size = step_size
+        step_size = step_size,
+        fieldnames = ['consumer1', 'consumer2']
     )
 
     # Stratified water storage tank.
@@ -154,18 +199,34 @@ def initializeSimulators(world, step_size, outfile_name):
         print_results = False,
         save_h5 = True,
         h5_store_name = outfile_name,
-        h5_frame_name = 'results'
+        h5_frame_name = h5_frame_name,
+        h5_flush_steps = H5_FLUSH_STEPS,
+        h5_writer_queue_size = H5_WRITER_QUEUE_SIZE,
+        delta_recording = DELTA_RECORDING,
+        output_format = output_format,
+        parquet_root = outfile_name if output_format == 'parquet' else None,
+        scenario_id = scenario_id,
+        scenario_params = scenario_params
     )
 
     return simulators
 
 
-def instantiateEntities(simulators, profiles, voltage_control_enabled = True):
+def instantiateEntities(simulators, profiles, voltage_control_enabled = True, params = None, step_size = STEP_SIZE):
     '''
-    Create instances of simulators.
+    Create instances of simulators. The default entity parameters can be overwritten
+    per entity (e.g., params = {'storage_tank': {'NB_LAYERS': 20}}). The rating of the
+    heat pump (heat_pump.P_rated) also sets the rating and minimum operating point used by
+    the flex heat controller and the voltage controller.
     '''
+    from simulators.time_series_player import register_profile
+
     entities = {}
 
+    # Share the profiles between all time series players.
+    for name, profile in profiles.items():
+        register_profile(name, profile)
+
     # Electrical network.
     entities['el_network'] = simulators['el_network'].Grid(
         gridfile = 'resources/power/power_grid_model.json',
@@ -178,35 +239,17 @@ def instantiateEntities(simulators, profiles, voltage_control_enabled = True):
     entities.update( {element.eid: element for element in grid if element.type in 'Bus'} )
     entities.update( {element.eid: element for element in grid if element.type in 'Line'} )
 
-    # Time series player for the power consumption profile of load 1.
-    entities['consumer_load1'] = simulators['load_gen_profiles'].TimeSeriesPlayer(
-        t_start = START_TIME,
-        series = profiles['power_demand'].copy(),
-        fieldname = 'Load_1',
-        interp_method = 'pchip',
-    )
-
-    # Time series player for the power consumption profile of load 2.
-    entities['consumer_load2'] = simulators['load_gen_profiles'].TimeSeriesPlayer(
+    # Time series player for the power consumption profiles of all loads (outputs 'Load_1', 'Load_2').
+    entities['consumer_loads'] = simulators['load_gen_profiles'].MultiTimeSeriesPlayer(
         t_start = START_TIME,
-        series = profiles['power_demand'].copy(),
-        fieldname = 'Load_2',
+        series = 'power_demand',
         interp_method = 'pchip',
     )
 
-    # Time series player for generation profile of PV 1.
-    entities['gen_pv1'] = simulators['load_gen_profiles'].TimeSeriesPlayer(
+    # Time series player for the generation profiles of all PVs (outputs 'PV_1', 'PV_2').
+    entities['gen_pvs'] = simulators['load_gen_profiles'].MultiTimeSeriesPlayer(
         t_start = START_TIME,
-        series = profiles['pv_generation'].copy(),
-        fieldname = 'PV_1',
-        interp_method = 'pchip',
-    )
-
-    # Time series player for generation profile of PV 2.
-    entities['gen_pv2'] = simulators['load_gen_profiles'].TimeSeriesPlayer(
-        t_start = START_TIME,
-        series = profiles['pv_generation'].copy(),
-        fieldname = 'PV_2',
+        series = 'pv_generation',
         interp_method = 'pchip',
     )
 
@@ -234,60 +277,58 @@ def instantiateEntities(simulators, profiles, voltage_control_enabled = True):
         mdot_hex_out = -3.5,
     )
 
-    # Time series player for heat demand of consumer 1.
-    entities['heat_profiles1'] = simulators['heat_profiles'].TimeSeriesPlayer(
-        t_start = START_TIME,
-        series = profiles['heat_demand'].copy(),
-        fieldname = 'consumer1',
-    )
-
-
-    # Time series player for heat demand of consumer 2.
-    entities['heat_profiles2'] = simulators['heat_profiles'].TimeSeriesPlayer(
+    # Time series player for the heat demand of all consumers (outputs 'consumer1', 'consumer2').
+    entities['heat_profiles'] = simulators['heat_profiles'].MultiTimeSeriesPlayer(
         t_start = START_TIME,
-        series = profiles['heat_demand'].copy(),
-        fieldname = 'consumer2',
+        series = 'heat_demand',
     )
 
     # Stratified water storage tank.
-    entities['storage_tank'] = simulators['storage_tank'].WaterStorageTank(
+    entities['storage_tank'] = simulators['storage_tank'].WaterStorageTank(**scenarioParams(params, 'storage_tank',
         INNER_HEIGHT = 9.2-0.5-0.4-0.4,  # Full tank height, minus valve height, minus half rounded end height
         INNER_DIAMETER = 3.72,
         INSULATION_THICKNESS = 0.1,
         STEEL_THICKNESS = 0.02,
         NB_LAYERS = 10,
         T_volume_initial = INIT_STORAGE_TANK_TEMP,
-        dt = STEP_SIZE
-    )
+        dt = step_size,
+        substepping = True  # Keep the tank model stable for large step sizes
+    ))
 
     # Heat pump.
-    entities['heat_pump'] = simulators['heat_pump'].ConstantTcondHP(
+    hp_params = scenarioParams(params, 'heat_pump',
         P_rated = 100.0,
         lambda_comp = 0.2,
         P_0 = 0.3,
         eta_sys = 0.5,
         eta_comp = 0.7,
         T_evap_out_min = 20,
-        dt = STEP_SIZE,
+        dt = step_size,
         T_cond_out_target = HP_TEMP_COND_OUT_TARGET,  # degC
     )
+    entities['heat_pump'] = simulators['heat_pump'].ConstantTcondHP(**hp_params)
+
+    # Rated el. consumption of the heat pump (kWe), also used by both controllers.
+    hp_p_rated = hp_params['P_rated']
 
     # Flex heat controller.
-    entities['flex_heat_ctrl'] = simulators['flex_heat_ctrl'].SimpleFlexHeatController(
-        voltage_control_enabled = voltage_control_enabled
-    )
+    entities['flex_heat_ctrl'] = simulators['flex_heat_ctrl'].SimpleFlexHeatController(**scenarioParams(params, 'flex_heat_ctrl',
+        voltage_control_enabled = voltage_control_enabled,
+        P_hp_rated = hp_p_rated,
+        hp_operating_threshold = 0.35 * hp_p_rated,
+    ))
 
     # Voltage controller.
-    entities['voltage_ctrl'] = simulators['voltage_ctrl'].VoltageController(
+    entities['voltage_ctrl'] = simulators['voltage_ctrl'].VoltageController(**scenarioParams(params, 'voltage_ctrl',
         delta_vm_upper_pu = 0.1,
         delta_vm_lower_pu_hp_on = -0.1,
         delta_vm_lower_pu_hp_off = -0.08,
         delta_vm_deadband = 0.03,
-        hp_p_el_mw_rated = 0.1,
-        hp_p_el_mw_min = 0.4 * 0.1,
-        hp_operation_steps_min = 30 * 60 / STEP_SIZE,
+        hp_p_el_mw_rated = 1e-3 * hp_p_rated,
+        hp_p_el_mw_min = 0.4 * 1e-3 * hp_p_rated,
+        hp_operation_steps_min = 30 * 60 / step_size,
         k_p = 0.15
-    )
+    ))
 
     # Data collector.
     entities['sc_monitor'] = simulators['collector'].Collector()
@@ -302,12 +343,12 @@ def connectEntities(world, entities):
     from simulators.el_network.simulator import make_eid as grid_id
     
     # Connect electrical consumption profiles to electrical loads.
-    world.connect(entities['consumer_load1'], entities[grid_id('Load_1',0)], ('out', 'p_mw'))
-    world.connect(entities['consumer_load2'], entities[grid_id('Load_2',0)], ('out', 'p_mw'))
+    world.connect(entities['consumer_loads'], entities[grid_id('Load_1',0)], ('Load_1', 'p_mw'))
+    world.connect(entities['consumer_loads'], entities[grid_id('Load_2',0)], ('Load_2', 'p_mw'))
 
     # Connect PV profiles to static generators.
-    world.connect(entities['gen_pv1'], entities[grid_id('PV_1',0)], ('out', 'p_mw'))
-    world.connect(entities['gen_pv2'], entities[grid_id('PV_2',0)], ('out', 'p_mw'))
+    world.connect(entities['gen_pvs'], entities[grid_id('PV_1',0)], ('PV_1', 'p_mw'))
+    world.connect(entities['gen_pvs'], entities[grid_id('PV_2',0)], ('PV_2', 'p_mw'))
 
     # Voltage controller.
     world.connect(entities[grid_id('Bus_1',0)], entities['voltage_ctrl'], ('vm_pu', 'vmeas_pu'))
@@ -322,15 +363,15 @@ def connectEntities(world, entities):
     world.connect(entities['hex_consumer2'], entities['dh_network'], ('mdot_hex_out', 'mdot_cons2_set'))
 
     # Heat demand consumer 1.
-    world.connect(entities['heat_profiles1'], entities['dh_network'], ('out', 'Qdot_cons1'))
-    world.connect(entities['heat_profiles1'], entities['hex_consumer1'], ('out', 'P_heat'))
+    world.connect(entities['heat_profiles'], entities['dh_network'], ('consumer1', 'Qdot_cons1'))
+    world.connect(entities['heat_profiles'], entities['hex_consumer1'], ('consumer1', 'P_heat'))
     world.connect(entities['hex_consumer1'], entities['flex_heat_ctrl'], ('mdot_hex_out', 'mdot_HEX1'))
     world.connect(entities['dh_network'], entities['hex_consumer1'], ('T_supply_cons1', 'T_supply'),
         time_shifted=True, initial_data={'T_supply_cons1': 70})
 
     # Heat demand consumer 1.
-    world.connect(entities['heat_profiles2'], entities['dh_network'], ('out', 'Qdot_cons2'))
-    world.connect(entities['heat_profiles2'], entities['hex_consumer2'], ('out', 'P_heat'))
+    world.connect(entities['heat_profiles'], entities['dh_network'], ('consumer2', 'Qdot_cons2'))
+    world.connect(entities['heat_profiles'], entities['hex_consumer2'], ('consumer2', 'P_heat'))
     world.connect(entities['hex_consumer2'], entities['flex_heat_ctrl'], ('mdot_hex_out', 'mdot_HEX2'))
     world.connect(entities['dh_network'], entities['hex_consumer2'], ('T_supply_cons2', 'T_supply'),
         time_shifted=True, initial_data={'T_supply_cons2': 70})
@@ -426,9 +467,51 @@ def connectDataCollector(world, entities):
             world.connect(entities[ent], entities['sc_monitor'], outputname)
 
 
+def runScenario(outfile_name, step_size = STEP_SIZE, end = END, voltage_control_enabled = True,
+                params = None, profiles = None, h5_frame_name = 'results', mosaik_config = None,
+                output_format = 'h5', scenario_id = 'default', scenario_params = None):
+    '''
+    Run a single co-simulation of the benchmark and save the results to an HDF5 store
+    (or a Parquet dataset, see initializeSimulators).
+    Parameter params may contain the key 'profile_scaling' (scaling factors per profile)
+    in addition to the entity parameters (see instantiateEntities).
+    '''
+    import mosaik
+
+    # Load profiles for demand (heat, power) and PV generation.
+    if profiles is None:
+        profiles = loadProfiles()
+
+    params = dict(params or {})
+    checkScenarioParams(params, list(profiles))
+    if scenario_params is None:
+        # Parameters stored with the Parquet results.
+        scenario_params = dict(params, voltage_control_enabled = voltage_control_enabled, step_size = step_size, end = end)
+    profile_scaling = params.pop('profile_scaling', None)
+    profiles = scaleProfiles(profiles, profile_scaling)
+
+    # Start MOSAIK orchestrator.
+    world = mosaik.World(SIM_CONFIG, mosaik_config)
+
+    # Initialize and start all simulators.
+    simulators = initializeSimulators(world, step_size, outfile_name, h5_frame_name,
+                                      output_format, scenario_id, scenario_params)
+
+    # Create instances of simulators.
+    entities = instantiateEntities(simulators, profiles, voltage_control_enabled, params, step_size)
+
+    # Add connections between the simulator entities.
+    connectEntities(world, entities)
+
+    # Configure and connect the data collector.
+    connectDataCollector(world, entities)
+
+    # Run the simulation.
+    world.run(until = end)
+
+
 if __name__ == '__main__':
     import argparse
-    import mosaik
     from time import time, ctime
     from datetime import timedelta
 
@@ -438,6 +521,8 @@ if __name__ == '__main__':
     parser.add_argument('--voltage-control-disabled', action = 'store_true', help = 'disable voltage control')
     parser.add_argument('--step-size', type = int, default = STEP_SIZE, help = 'simulation step size in seconds')
     parser.add_argument('--end', type = int, default = END, help = 'simulation period in seconds')
+    parser.add_argument('--format', choices = ['h5', 'parquet'], default = 'h5', help = 'results format (parquet: outfile is a directory)')
+    parser.add_argument('--scenario-id', default = 'default', help = 'scenario id (partition of the Parquet results)')
     args = parser.parse_args()
 
     voltage_control_enabled = not args.voltage_control_disabled
@@ -448,26 +533,9 @@ if __name__ == '__main__':
     sim_start_time = time()
     print("CO-SIMULATION STARTED AT:", ctime(sim_start_time))
 
-    # Start MOSAIK orchestrator.
-    world = mosaik.World(SIM_CONFIG)
-
-    # Initialize and start all simulators.
-    simulators = initializeSimulators(world, step_size, outfile_name)
-
-    # Load profiles for demand (heat, power) and PV generation.
-    profiles = loadProfiles()
-
-    # Create instances of simulators.
-    entities = instantiateEntities(simulators, profiles, voltage_control_enabled)
-
-    # Add connections between the simulator entities.
-    connectEntities(world, entities)
-
-    # Configure and connect the data collector.
-    connectDataCollector(world, entities)
-
-    # Run the simulation.
-    world.run(until = end)
+    # Run the co-simulation.
+    runScenario(outfile_name, step_size, end, voltage_control_enabled,
+                output_format = args.format, scenario_id = args.scenario_id)
 
     sim_elapsed_time = str(timedelta(seconds = time() - sim_start_time))
     print('TOTAL ELAPSED CO-SIMULATION TIME:', sim_elapsed_time)
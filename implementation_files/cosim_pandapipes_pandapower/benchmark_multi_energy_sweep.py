@@ -0,0 +1,224 @@
+# Copyright (c) 2021 by ERIGrid 2.0. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+'''
+Run a parameter sweep of the ERIGrid 2.0 multi-energy benchmark. The scenarios are executed
+in parallel in a pool of worker processes (one MOSAIK world per scenario) and the results are
+collected in a single HDF5 store, indexed by scenario id.
+
+The sweep is defined in a JSON file, which maps parameters to lists of values. The scenarios
+are all combinations of these values. Entity parameters are addressed as "<entity>.<param>"
+(see instantiateEntities), profile scaling factors as "profile_scaling.<profile>". The
+heat pump rating "heat_pump.P_rated" also applies to the flex heat and voltage controllers:
+{
+    "voltage_control_enabled": [true, false],
+    "voltage_ctrl.delta_vm_upper_pu": [0.08, 0.1],
+    "flex_heat_ctrl.T_tank_max": [70, 72],
+    "storage_tank.NB_LAYERS": [10, 20],
+    "heat_pump.P_rated": [100.0, 150.0],
+    "profile_scaling.heat_demand": [1.0, 1.2]
+}
+
+With output format 'parquet', all scenarios write directly to one Parquet dataset (a
+directory, partitioned by scenario id) and the scenario table is stored as scenarios.parquet.
+'''
+
+from benchmark_multi_energy_sim import STEP_SIZE, END, loadProfiles, checkScenarioParams, runScenario
+
+# Bind the MOSAIK server socket of each world to a free port, to allow parallel worlds.
+MOSAIK_CONFIG = {'addr': ('127.0.0.1', 0)}
+
+# Name of the table with the parameters of all scenarios.
+SCENARIO_TABLE = 'scenarios'
+
+# Profiles loaded by a worker process.
+_profiles = None
+
+
+def createScenarios(sweep):
+    '''
+    Create all combinations of the parameter values of a sweep.
+    '''
+    import itertools
+
+    names = list(sweep.keys())
+    scenarios = {}
+    for i, values in enumerate(itertools.product(*sweep.values())):
+        scenarios['scenario_{:04d}'.format(i)] = dict(zip(names, values))
+
+    return scenarios
+
+
+def scenarioArguments(scenario):
+    '''
+    Translate the flat parameters of a scenario into the arguments of runScenario.
+    '''
+    scenario = dict(scenario)
+    voltage_control_enabled = scenario.pop('voltage_control_enabled', True)
+
+    params = {}
+    for name, value in scenario.items():
+        if '.' not in name:
+            raise ValueError('Invalid scenario parameter: {} (expected "<entity>.<param>").'.format(name))
+        entity, param = name.split('.', 1)
+        params.setdefault(entity, {})[param] = value
+
+    return voltage_control_enabled, params
+
+
+def _runScenarioWorker(scenario_id, scenario, outfile_name, step_size, end, output_format = 'h5'):
+    '''
+    Run a single scenario in a worker process.
+    '''
+    from time import time
+
+    start_time = time()
+    voltage_control_enabled, params = scenarioArguments(scenario)
+
+    # The profiles are loaded once per worker process.
+    global _profiles
+    if _profiles is None:
+        _profiles = loadProfiles()
+
+    runScenario(outfile_name, step_size, end, voltage_control_enabled, params,
+                profiles = _profiles, mosaik_config = MOSAIK_CONFIG, output_format = output_format,
+                scenario_id = scenario_id, scenario_params = dict(scenario, step_size = step_size, end = end))
+
+    return scenario_id, time() - start_time
+
+
+def mergeResults(store_name, scenario_id, part_name):
+    '''
+    Copy the results of a scenario into the store of the sweep and delete the part file. The
+    results are stored in table format, such that selected columns can be read without reading
+    the whole frame (results written by the collector in table format are copied unchanged).
+    '''
+    import os
+    import pandas as pd
+    import tables
+
+    with pd.HDFStore(part_name, 'r') as part:
+        is_table = part.get_storer('results').is_table
+        results = None if is_table else part['results']
+
+    with tables.open_file(store_name, 'a') as store:
+        if '/' + scenario_id in store:
+            store.remove_node('/' + scenario_id, recursive = True)
+
+        if is_table:
+            with tables.open_file(part_name, 'r') as part:
+                part.copy_node('/results', newparent = store.create_group('/', scenario_id), recursive = True)
+
+    if results is not None:
+        with pd.HDFStore(store_name, complevel = 5, complib = 'blosc') as store:
+            store.append('{}/results'.format(scenario_id), results, format = 'table')
+
+    os.remove(part_name)
+
+
+def runSweep(scenarios, outfile_name, step_size = STEP_SIZE, end = END, max_workers = None, output_format = 'h5',
+             overwrite = False):
+    '''
+    Run all scenarios in a pool of worker processes. The results of each scenario are stored
+    as "<scenario id>/results" in the store, the parameters and status of all scenarios in
+    table "scenarios". With output format 'parquet', the scenarios write their results to
+    the Parquet dataset outfile_name (partition "scenario=<scenario id>"). An existing output
+    is only replaced (deleted before the scenarios are started) if overwrite is True.
+    '''
+    import os
+    import pathlib
+    import shutil
+    import pandas as pd
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    # Check the parameters of all scenarios before starting any of them.
+    profile_names = list(loadProfiles())
+    for scenario in scenarios.values():
+        checkScenarioParams(scenarioArguments(scenario)[1], profile_names)
+
+    # Results of previous sweeps must not be mixed with the results of this sweep.
+    outputs = [pathlib.Path(outfile_name)]
+    if output_format != 'parquet':
+        outputs.append(pathlib.Path(outfile_name + '.parts'))
+    for output in outputs:
+        if not output.exists():
+            continue
+        if not overwrite:
+            raise FileExistsError('Output {} already exists (use overwrite to replace it).'.format(output))
+        if output.is_dir():
+            shutil.rmtree(output)
+        else:
+            os.remove(output)
+
+    if output_format == 'parquet':
+        parts_dir = pathlib.Path(outfile_name)
+    else:
+        parts_dir = pathlib.Path(outfile_name + '.parts')
+    parts_dir.mkdir(exist_ok = True)
+
+    table = pd.DataFrame.from_dict(scenarios, orient = 'index')
+    table['elapsed_time'] = float('nan')
+    table['status'] = 'failed'
+
+    with ProcessPoolExecutor(max_workers = max_workers) as executor:
+        futures = {
+            executor.submit(_runScenarioWorker, scenario_id, scenario,
+                            outfile_name if output_format == 'parquet' else str(parts_dir / '{}.h5'.format(scenario_id)),
+                            step_size, end, output_format): scenario_id
+            for scenario_id, scenario in scenarios.items()
+        }
+
+        for future in as_completed(futures):
+            scenario_id = futures[future]
+            try:
+                _, elapsed_time = future.result()
+            except Exception as e:
+                print('SCENARIO {} FAILED: {}'.format(scenario_id, e))
+                continue
+
+            if output_format != 'parquet':
+                mergeResults(outfile_name, scenario_id, str(parts_dir / '{}.h5'.format(scenario_id)))
+            table.at[scenario_id, 'elapsed_time'] = elapsed_time
+            table.at[scenario_id, 'status'] = 'done'
+            print('SCENARIO {} DONE ({:.1f} s)'.format(scenario_id, elapsed_time))
+
+    if output_format == 'parquet':
+        table.astype({'status': str}).to_parquet(parts_dir / (SCENARIO_TABLE + '.parquet'))
+        return table
+
+    with pd.HDFStore(outfile_name) as store:
+        store.put(SCENARIO_TABLE, table.astype({'status': str}))
+
+    if not any(parts_dir.iterdir()):
+        os.rmdir(parts_dir)
+
+    return table
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    from time import time, ctime
+    from datetime import timedelta
+
+    # Parse command line options.
+    parser = argparse.ArgumentParser()
+    parser.add_argument('sweep', help = 'JSON file defining the parameter sweep')
+    parser.add_argument('--outfile', default = 'benchmark_sweep_results.h5', help = 'results file name')
+    parser.add_argument('--workers', type = int, default = None, help = 'number of worker processes (default: number of CPUs)')
+    parser.add_argument('--step-size', type = int, default = STEP_SIZE, help = 'simulation step size in seconds')
+    parser.add_argument('--end', type = int, default = END, help = 'simulation period in seconds')
+    parser.add_argument('--format', choices = ['h5', 'parquet'], default = 'h5', help = 'results format (parquet: outfile is a directory)')
+    parser.add_argument('--overwrite', action = 'store_true', help = 'replace the results of a previous sweep')
+    args = parser.parse_args()
+
+    with open(args.sweep) as f:
+        scenarios = createScenarios(json.load(f))
+
+    sweep_start_time = time()
+    print('PARAMETER SWEEP WITH {} SCENARIOS STARTED AT:'.format(len(scenarios)), ctime(sweep_start_time))
+
+    table = runSweep(scenarios, args.outfile, args.step_size, args.end, args.workers, args.format, args.overwrite)
+
+    sweep_elapsed_time = str(timedelta(seconds = time() - sweep_start_time))
+    print('SCENARIOS COMPLETED: {} / {}'.format((table['status'] == 'done').sum(), len(table)))
+    print('TOTAL ELAPSED SWEEP TIME:', sweep_elapsed_time)
@@ -0,0 +1,139 @@
+# Copyright (c) 2021 by ERIGrid 2.0. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+
+import warnings
+import numpy as np
+import pandas as pd
+
+
+class HistoryStore:
+    '''
+    Columnar, NumPy-backed store for the time history of the network results.
+
+    Rows are appended at the tail of a preallocated buffer and evicted from its head once they
+    are older than the retention window. When the tail reaches the end of the buffer, the live
+    rows are either moved back to the start or the buffer is doubled in size, which keeps the
+    cost of an append amortized O(1) and the live rows contiguous and ordered in time.
+    '''
+
+    def __init__(self, columns, window=None, capacity=64):
+        self.columns = list(columns)
+        self.col_index = {name: i for i, name in enumerate(self.columns)}
+        self.window = window  # Retention window [s], no eviction if None
+        self.evicted = False  # Rows have been evicted (lookups before the first retained row are clamped)
+
+        self._time = np.empty(capacity)
+        self._data = np.empty((capacity, len(self.columns)))
+        self._head = 0
+        self._tail = 0
+
+    def __len__(self):
+        return self._tail - self._head
+
+    @property
+    def empty(self):
+        return self._tail == self._head
+
+    @property
+    def time(self):
+        '''
+        Time index of the retained rows (monotonically increasing).
+        '''
+        return self._time[self._head:self._tail]
+
+    @property
+    def data(self):
+        '''
+        Retained rows as 2-D array (rows: time, columns: store columns).
+        '''
+        return self._data[self._head:self._tail]
+
+    def column(self, name):
+        return self._data[self._head:self._tail, self.col_index[name]]
+
+    def append(self, time, values):
+        if not self.empty:
+            last_time = self._time[self._tail - 1]
+            if time == last_time:
+                # Replace results of a repeated time step
+                self._data[self._tail - 1] = values
+                return
+            elif time < last_time:
+                raise ValueError(f'Time {time} is before the last stored time {last_time}.')
+
+        if self._tail == len(self._time):
+            self._make_room()
+
+        self._time[self._tail] = time
+        self._data[self._tail] = values
+        self._tail += 1
+
+        self.evict(time)
+
+    def interp(self, times, col_ids):
+        '''
+        Linearly interpolate one column per query time in a single pass (same semantics as
+        np.interp, i.e., values are held constant outside the retained time range). Warns if
+        a query time falls before the first retained row after rows have been evicted.
+        :param times: array of query times
+        :param col_ids: array of column indices (one per query time)
+        :return: array of interpolated values
+        '''
+        t = self.time
+        data = self.data
+        times = np.asarray(times, dtype=float)
+
+        if self.evicted:
+            # Infinite query times (stagnant flow) are clamped on purpose
+            evicted_times = times[np.isfinite(times) & (times < t[0])]
+            if evicted_times.size:
+                warnings.warn('History lookup at t={0} before the first retained time t={1} (retention window {2} s), '
+                              'the values are clamped.'.format(evicted_times.min(), t[0], self.window), UserWarning, stacklevel=2)
+
+        if len(t) == 1:
+            return data[0, col_ids].astype(float)
+
+        # Binary search for the row at or before each (clamped) query time
+        times = np.clip(times, t[0], t[-1])
+        i = np.clip(np.searchsorted(t, times, side='right') - 1, 0, len(t) - 2)
+
+        y0 = data[i, col_ids]
+        y1 = data[i + 1, col_ids]
+        w = (times - t[i]) / (t[i + 1] - t[i])
+        return y0 + w * (y1 - y0)
+
+    def evict(self, time):
+        '''
+        Drop all rows that are no longer needed to look up values within the retention window.
+        The newest row older than the window is kept, so that lookups at the window boundary can
+        still be interpolated.
+        '''
+        if self.window is None:
+            return
+
+        t = self.time
+        keep_from = np.searchsorted(t, time - self.window, side='right') - 1
+        if keep_from > 0:
+            self._head += int(keep_from)
+            self.evicted = True
+
+    def to_frame(self):
+        return pd.DataFrame(self.data.copy(), index=self.time.copy(), columns=self.columns)
+
+    def _make_room(self):
+        size = len(self)
+        capacity = len(self._time)
+
+        # Grow only if the live rows fill more than half of the buffer, otherwise compact.
+        if 2 * size > capacity:
+            capacity *= 2
+
+        time = np.empty(capacity)
+        data = np.empty((capacity, len(self.columns)))
+        time[:size] = self.time
+        data[:size] = self.data
+
+        self._time = time
+        self._data = data
+        self._head = 0
+        self._tail = size
@@ -16,6 +16,11 @@ META = {
                 'T_supply_grid',
                 'P_grid_bar',
                 'dynamic_temp_flow_enabled',
+                'generic_topology_enabled',
+                'history_window',
+                'history_min_velocity',
+                'hydraulic_warm_start',
+                'flow_control_mode',
                 ],
             'attrs': [
                 # Input
@@ -5,11 +5,12 @@ import sys
 import math
 from dataclasses import dataclass, field
 from typing import Dict
-import pandas as pd
 import numpy as np
 import pandapipes as pp
 import pandapipes.control.run_control as run_control
-from .valve_control import CtrlValve
+from .valve_control import CtrlValve, MultiValveCtrl
+from .history_store import HistoryStore
+from .topology import NetworkTopology
 # import matplotlib.pyplot as plt
 # import pandapipes.plotting as plot
 
@@ -33,6 +34,15 @@ class DHNetwork:
     P_hp_bar: float = 6  # Pressure of the heat pump + storage unit [bar]
     tank_installed: bool = True  # Enable hp + tank connection point
     dynamic_temp_flow_enabled: bool = True  # Enable external temperature flow sim incl. network inertia
+    generic_topology_enabled: bool = False  # Derive the pipe processing order of the dynamic temperature flow from the flow directions (any network topology)
+    history_window: float = None  # Retention window of the dynamic temperature history [s] (None: sized from the largest pipe transit time)
+    history_window_max: float = 24 * 60 * 60  # Upper limit of the automatically sized retention window [s]
+    history_min_velocity: float = 0.02  # Lowest flow velocity covered by the automatically sized retention window [m/s]
+    hydraulic_warm_start: bool = False  # Skip the hydraulic control loop for unchanged inputs and warm-start it otherwise
+    warm_start_mdot_tol: float = 1e-3  # Tolerance for unchanged mass flow setpoints [kg/s]
+    warm_start_qdot_tol: float = 1e-3  # Tolerance for unchanged heat loads [kW]
+    warm_start_temp_tol: float = 1e-3  # Tolerance for unchanged supply temperatures [K]
+    flow_control_mode: str = 'pid'  # Valve flow control: 'pid' (one CtrlValve per valve) or 'jacobian' (coordinated MultiValveCtrl)
 
     # Magnitudes
     CP_WATER: float = 4186  # Specific heat capacity of water [J/(kgK)]
@@ -73,8 +83,11 @@ class DHNetwork:
     # Internal variables
     # plot_results_enabled: bool = False  # calculates static and dynamic heat flow and compares both results (only when dynamic temp flow enabled!)
     compare_to_static_results: bool = False  # calculates static and dynamic heat flow and compares both results (only when dynamic temp flow enabled
-    store: Dict[str, pd.DataFrame] = field(default_factory=dict)
+    store: Dict[str, HistoryStore] = field(default_factory=dict)
     cur_t: float = 0  # Actual time [s]
+    max_transit_time: float = 0  # Largest pipe transit time observed so far [s]
+    hydraulic_inputs: np.ndarray = None  # Inputs of the last converged hydraulic control loop
+    loss_coeff_map: Dict[str, dict] = field(default_factory=dict)  # Learned loss coefficients per valve controller (setpoint bin -> loss coefficient)
 
     # Network utils
     net: pp.pandapipesNet = None
@@ -86,21 +99,48 @@ class DHNetwork:
     sink: list = None
     source: list = None
     circ_pump: list = None
+    topology: NetworkTopology = None
+
+    # Pipe parameters (in order of the pipe table)
+    pipe_length_m: np.ndarray = None  # Pipe length [m]
+    pipe_loss_coeff: np.ndarray = None  # Heat loss coefficient [W/mK]
+    pipe_text_k: np.ndarray = None  # Ambient temperature [K]
+    junction_column: np.ndarray = None  # Store column of the junction temperatures
+    pipe_t_in_k: np.ndarray = None  # Delayed pipe inlet temperatures of the current step [K]
+    pipe_t_out_k: np.ndarray = None  # Pipe outlet temperatures of the current step [K]
 
     def __post_init__(self):
         self._create_network()
+        self.topology = NetworkTopology(self.net)
         self._init_output_store()
+        self._init_pipe_parameters()
         warnings.filterwarnings('ignore', message='Pipeflow converged, however, the results are phyisically incorrect as pressure is negative at nodes*')
 
     def _init_output_store(self):
+        # Columns of the output storage
+        columns = ['temp_' + j for j in self.junction]
+        columns += ['temp_' + l for l in self.pipe]
+        columns += ['mdot_' + l for l in self.pipe]
+        columns += ['dt_' + l for l in self.pipe]
+
         # Init output storage
         if self.dynamic_temp_flow_enabled:
-            self.store['dynamic'] = {}
+            self.store['dynamic'] = HistoryStore(columns, window=self.history_window)
             if self.compare_to_static_results:
-                self.store['static'] = {}
+                self.store['static'] = HistoryStore(columns, window=self.history_window)
 
         else:
-            self.store['static'] = {}
+            self.store['static'] = HistoryStore(columns, window=self.history_window)
+
+    def _init_pipe_parameters(self):
+        net = self.net
+        self.pipe_length_m = net.pipe['length_km'].values * 1000
+        self.pipe_loss_coeff = net.pipe['alpha_w_per_m2k'].values * math.pi * net.pipe['diameter_m'].values
+        self.pipe_text_k = net.pipe['text_k'].values
+
+        # Columns of the store containing the temperature history of the junctions
+        col_index = next(iter(self.store.values())).col_index
+        self.junction_column = np.array([col_index['temp_' + name] for name in self.topology.junction_names])
 
     def step_single(self, time):
         j = self.junction
@@ -114,6 +154,7 @@ class DHNetwork:
 
         # Run hydraulic flow (steady-state)
         self.run_hydraulic_control()
+        self.topology.update_valve_status(self.net)
 
         if not self.dynamic_temp_flow_enabled:
             self._run_static_pipeflow()
@@ -146,12 +187,82 @@ class DHNetwork:
         self.mdot_tank_in = - self.mdot_tank_out
 
     def run_hydraulic_control(self):
+        if self.hydraulic_warm_start:
+            inputs, tol = self._get_hydraulic_inputs()
+
+            # Skip the control loop if the inputs have not changed since the last converged run
+            if self.hydraulic_inputs is not None and np.all(np.abs(inputs - self.hydraulic_inputs) <= tol):
+                return
+
+            self._warm_start_hydraulic_control()
+
         # Ignore user warnings of control
         try:
             run_control(self.net, max_iter=100)
         except:
             # Throw UserWarning
             warnings.warn('Controller not converged: maximum number of iterations per controller is reached at time t={}.'.format(self.cur_t), UserWarning, stacklevel=2)
+            self.hydraulic_inputs = None
+        else:
+            if self.hydraulic_warm_start:
+                self.hydraulic_inputs = inputs
+                self._learn_loss_coefficients()
+
+    def _get_valve_controllers(self):
+        return self.net.controller['object'].tolist()
+
+    def _get_hydraulic_inputs(self):
+        setpoints = [s for ctrl in self._get_valve_controllers() for s in np.atleast_1d(ctrl.mdot_set_kg_per_s)]
+        loads = [self.Qdot_cons1, self.Qdot_cons2, self.Qdot_evap]
+        # Supply temperatures of the external grid and the storage unit
+        temperatures = self.net.ext_grid['t_k'].tolist()
+
+        inputs = np.array(setpoints + loads + temperatures, dtype=float)
+        tol = np.array([self.warm_start_mdot_tol] * len(setpoints) + [self.warm_start_qdot_tol] * len(loads) +
+                       [self.warm_start_temp_tol] * len(temperatures))
+        return inputs, tol
+
+    def _warm_start_hydraulic_control(self):
+        net = self.net
+
+        # Seed the valve positions from the learned loss coefficients
+        for ctrl in self._get_valve_controllers():
+            loss_coeff = np.array(ctrl.loss_coeff, dtype=float, ndmin=1)
+            valves = zip(np.atleast_1d(ctrl.name), np.atleast_1d(ctrl.mdot_set_kg_per_s),
+                         np.atleast_1d(ctrl.tolerance), np.atleast_1d(ctrl.opened))
+
+            for k, (name, setpoint, tol, opened) in enumerate(valves):
+                learned = self.loss_coeff_map.get(name)
+                if not learned or not opened:
+                    continue
+
+                setpoint_bin = self._setpoint_bin(setpoint, tol)
+                if setpoint_bin in learned:
+                    loss_coeff[k] = learned[setpoint_bin]
+                else:
+                    bins = sorted(learned)
+                    loss_coeff[k] = np.interp(setpoint_bin, bins, [learned[b] for b in bins])
+
+            ctrl.loss_coeff = loss_coeff if np.ndim(ctrl.loss_coeff) else loss_coeff[0]
+            net.valve.loc[np.atleast_1d(ctrl.gid), 'loss_coefficient'] = loss_coeff
+
+        # Use the previous pipeflow solution as initial guess for the pressures
+        if 'res_junction' in net and len(net.res_junction) == len(net.junction):
+            p_bar = net.res_junction['p_bar'].values
+            net.junction['pn_bar'] = np.where(np.isfinite(p_bar), p_bar, net.junction['pn_bar'].values)
+
+    def _setpoint_bin(self, setpoint, tol):
+        # Bins of the valve tolerance, at least as wide as the tolerance for unchanged setpoints (tolerance may be 0)
+        return round(setpoint / max(tol, self.warm_start_mdot_tol))
+
+    def _learn_loss_coefficients(self):
+        for ctrl in self._get_valve_controllers():
+            valves = zip(np.atleast_1d(ctrl.name), np.atleast_1d(ctrl.mdot_set_kg_per_s), np.atleast_1d(ctrl.tolerance),
+                         np.atleast_1d(ctrl.opened), np.atleast_1d(ctrl.loss_coeff))
+
+            for name, setpoint, tol, opened, loss_coeff in valves:
+                if opened:
+                    self.loss_coeff_map.setdefault(name, {})[self._setpoint_bin(setpoint, tol)] = loss_coeff
 
     def _run_static_pipeflow(self):
         pp.pipeflow(self.net, transient=False, mode='all', max_iter=100, run_control=True, heat_transfer=True)
@@ -174,68 +285,97 @@ class DHNetwork:
         self._store_output(label='dynamic')
 
     def _internal_heatflow_calc(self):
-        self._calc_forward_pipe_tempflow()
-        self._calc_backward_pipe_tempflow()
+        net = self.net
+        topo = self.topology
+
+        # Orient the network by the current flow directions
+        if self.generic_topology_enabled:
+            topo.update_flow_direction(net.res_pipe['mdot_from_kg_per_s'].values, net.res_valve['mdot_from_kg_per_s'].values)
+
+        # Working copies of the results (pipe temperatures at inlet/outlet in flow direction), written back once the heat flow is distributed
+        t_pipe_from_k = net.res_pipe['t_from_k'].values
+        t_pipe_to_k = net.res_pipe['t_to_k'].values
+        self.t_junction_k = net.res_junction['t_k'].values.copy()
+        self.t_pipe_inlet_k = np.where(topo.pipe_reversed, t_pipe_to_k, t_pipe_from_k)
+        self.t_pipe_outlet_k = np.where(topo.pipe_reversed, t_pipe_from_k, t_pipe_to_k)
+        self.mdot_pipe = np.abs(net.res_pipe['mdot_from_kg_per_s'].values)
+        self.t_hex_from_k = net.res_heat_exchanger['t_from_k'].values.copy()
+        self.t_hex_to_k = net.res_heat_exchanger['t_to_k'].values.copy()
+        self.mdot_hex = net.res_heat_exchanger['mdot_from_kg_per_s'].values
+        self.qext_hex_w = net.heat_exchanger['qext_w'].values
+
+        self._calc_delayed_pipe_tempflow()
+        if self.generic_topology_enabled:
+            self._calc_ordered_pipe_tempflow()
+        else:
+            self._calc_forward_pipe_tempflow()
+            self._calc_backward_pipe_tempflow()
+
+        net.res_junction['t_k'] = self.t_junction_k
+        net.res_pipe['t_from_k'] = np.where(topo.pipe_reversed, self.t_pipe_outlet_k, self.t_pipe_inlet_k)
+        net.res_pipe['t_to_k'] = np.where(topo.pipe_reversed, self.t_pipe_inlet_k, self.t_pipe_outlet_k)
+        net.res_heat_exchanger['t_from_k'] = self.t_hex_from_k
+        net.res_heat_exchanger['t_to_k'] = self.t_hex_to_k
+
+    def _calc_ordered_pipe_tempflow(self):
+        for p_id in self.topology.pipe_order:
+            self._internal_tempflow_calc(p_id)
+            self._update_temperature_flow(p_id)
 
     def _calc_forward_pipe_tempflow(self):
-        for pipe in self.pipe[0:7]:  # TODO: Make this applicable to any network topology
-            self._internal_tempflow_calc(pipe)
-            self._update_temperature_flow(pipe)
-
-    def _calc_consumer_return_temperature(self, hex):
-        h = self.heat_exchanger
-        p = self.pipe
-
-        from_j_id = self.net.heat_exchanger.at[h.index(hex), 'from_junction']
-        to_j_id = self.net.heat_exchanger.at[h.index(hex), 'to_junction']
-        qext_w = self.net.heat_exchanger.at[h.index(hex), 'qext_w']
-        forward_temp = self.net.res_junction.at[from_j_id, 't_k']
-        mdot = self.net.res_heat_exchanger.at[h.index(hex), 'mdot_from_kg_per_s']
+        for p_id in range(0, 7):  # Supply pipes of the benchmark network
+            self._internal_tempflow_calc(p_id)
+            self._update_temperature_flow(p_id)
+
+    def _calc_consumer_return_temperature(self, h_id):
+        topo = self.topology
+
+        to_j_id = topo.hex_to[h_id]
+        qext_w = self.qext_hex_w[h_id]
+        forward_temp = self.t_junction_k[topo.hex_from[h_id]]
+        mdot = self.mdot_hex[h_id]
         cp_w = self.CP_WATER
 
         # Set forward temperature to hex component
-        self.net.res_heat_exchanger.at[h.index(hex), 't_from_k'] = forward_temp
+        self.t_hex_from_k[h_id] = forward_temp
 
         # Calc return temperature at hex component
         return_temp = forward_temp - qext_w / (cp_w * mdot)
 
         # Set return temperature at hex component and connected junctions and pipes
-        self.net.res_heat_exchanger.at[h.index(hex), 't_to_k'] = return_temp
-        self.net.res_junction.at[to_j_id, 't_k'] = return_temp
-
-        conn_p_name = self.net.pipe['name'].loc[self.net.pipe['from_junction'] == to_j_id].values.tolist()
-        for pipe in conn_p_name:
-            self.net.res_pipe.at[p.index(pipe), 't_from_k'] = return_temp
+        self.t_hex_to_k[h_id] = return_temp
+        self.t_junction_k[to_j_id] = return_temp
+        self.t_pipe_inlet_k[topo.pipes_out(to_j_id)] = return_temp
 
-    def _calc_backward_pipe_tempflow(self):  # TODO: Make this applicable to any network topology
-        pipe_seq = self.pipe[7:14]
-        pipe_seq.reverse()
-        for pipe in pipe_seq:
-            self._internal_tempflow_calc(pipe)
-            self._update_temperature_flow(pipe)
+    def _calc_backward_pipe_tempflow(self):
+        for p_id in reversed(range(7, 14)):  # Return pipes of the benchmark network
+            self._internal_tempflow_calc(p_id)
+            self._update_temperature_flow(p_id)
 
-    def _store_output(self, label='static'):  # TODO: Improve due to low performance
-        data = {}
-
-        for j in self.junction:
-            data.update({'temp_' + j: round(self.net.res_junction.at[self.junction.index(j), 't_k'] - 273.15, 2)})
+    def _store_output(self, label='static'):
+        net = self.net
 
-        for l in self.pipe:
-            # Get temperature
-            data.update({'temp_' + l: round(self.net.res_pipe.at[self.pipe.index(l), 't_to_k'] - 273.15, 2)})
+        # Get temperatures and mass flows
+        temp_junction = net.res_junction['t_k'].values - 273.15
+        temp_pipe = net.res_pipe['t_to_k'].values - 273.15
+        mdot_pipe = net.res_pipe['mdot_from_kg_per_s'].values
 
-            # Get mass flow
-            data.update({'mdot_' + l: round(self.net.res_pipe.at[self.pipe.index(l), 'mdot_from_kg_per_s'], 2)})
+        # Determine thermal inertia
+        with np.errstate(divide='ignore', invalid='ignore'):
+            dt_pipe = net.pipe['length_km'].values * 1000 / net.res_pipe['v_mean_m_per_s'].values
 
-            # Determine thermal inertia
-            dx = self.net.pipe.at[self.pipe.index(l), 'length_km'] * 1000
-            v_mean = self.net.res_pipe.at[self.pipe.index(l), 'v_mean_m_per_s']
-            dt = dx / v_mean
-            data.update({'dt_' + l: round(dt, 2)})
+        # Size retention window from the largest pipe transit time, including the transit time at the
+        # lowest covered flow velocity (samples evicted now are needed if the flow slows down later)
+        store = self.store[label]
+        if self.history_window is None:
+            transit_time = np.abs(dt_pipe[np.isfinite(dt_pipe)])
+            if transit_time.size:
+                self.max_transit_time = max(self.max_transit_time, transit_time.max())
+            min_flow_transit_time = self.pipe_length_m.max() / self.history_min_velocity
+            store.window = min(2 * max(self.max_transit_time, min_flow_transit_time), self.history_window_max)
 
-        df = pd.DataFrame.from_dict(self.store[label])
-        df = df.append((pd.DataFrame(data=data, index=[self.cur_t])))
-        self.store[label] = df.to_dict()
+        data = np.round(np.concatenate((temp_junction, temp_pipe, mdot_pipe, dt_pipe)), 2)
+        store.append(self.cur_t, data)
 
     # def _plot_outputs(self):
 
@@ -252,7 +392,7 @@ class DHNetwork:
         # # Plot data
         # fig, ax = plt.subplots(nrows=len(plt_dict.keys()), ncols=1)
         # for sim in self.store:
-            # df = pd.DataFrame.from_dict(self.store[sim])
+            # df = self.store[sim].to_frame()
             # for i, (title, variables) in enumerate(plt_dict.items()):
 
                 # # create subplot figure setup
@@ -268,107 +408,94 @@ class DHNetwork:
                 # axes.set_prop_cycle(None)  # same colormap for dynamic and static
                 # axes.legend(loc='upper right')
 
-    def _internal_tempflow_calc(self, pipe):
-        # Set required input data
-        p = self.pipe
-        j = self.junction
-        net = self.net
-        mf = net.res_pipe.at[p.index(pipe), 'mdot_from_kg_per_s']
-        Cp_w = self.CP_WATER
-        dx = net.pipe.at[p.index(pipe), 'length_km'] * 1000
-        v_mean = net.res_pipe.at[p.index(pipe), 'v_mean_m_per_s']
-        alpha = net.pipe.at[p.index(pipe), 'alpha_w_per_m2k']
-        dia = net.pipe.at[p.index(pipe), 'diameter_m']
-        loss_coeff = alpha * math.pi * dia  # Heat loss coefficient in [W/mK]
-        Ta = net.pipe.at[p.index(pipe), 'text_k']
-
-        # Get junction connected to pipe inlet
-        j_in_id = self.net.pipe.at[p.index(pipe), 'from_junction']
-        j_in_name = self.net.junction.at[j_in_id, 'name']
-
-        # Get historic inlet temperature
-        df = pd.DataFrame.from_dict(self.store['dynamic'])
-
-        # Get historic inlet temperature
-        if not df.empty:
-            dt = dx / v_mean
-            delay_t = self.cur_t - dt
-            Tin = np.interp(delay_t, df.index, df['temp_' + j_in_name]) + 273.15  # TODO: Reduce calls due to performance
-        else:
-            Tin = net.res_junction.at[j_in_id, 't_k']
+    def _calc_delayed_pipe_tempflow(self):
+        store = self.store['dynamic']
 
-        # Static temperature drop
-        # Tin = net.res_junction.at[j_in_id, 't_k']
+        # Without history, the inlet temperatures are taken from the current results (see _internal_tempflow_calc)
+        if store.empty:
+            self.pipe_t_in_k = None
+            self.pipe_t_out_k = None
+            return
 
-        # Set current inlet temperature of pipe
-        net.res_pipe.at[p.index(pipe), 't_from_k'] = Tin
+        # Transit delay of all pipes
+        v_mean = np.abs(self.net.res_pipe['v_mean_m_per_s'].values)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            delay_t = self.cur_t - self.pipe_length_m / v_mean
+
+        # Get historic inlet temperatures of all pipes
+        self.pipe_t_in_k = store.interp(delay_t, self.junction_column[self.topology.pipe_inlet]) + 273.15
+        self.pipe_t_out_k = self._calc_pipe_outlet_temperature(self.pipe_t_in_k)
+
+    def _calc_pipe_outlet_temperature(self, t_in_k, pipe_ids=slice(None)):
+        mf = np.abs(self.net.res_pipe['mdot_from_kg_per_s'].values[pipe_ids])
+        dx = self.pipe_length_m[pipe_ids]
+        loss_coeff = self.pipe_loss_coeff[pipe_ids]
+        Ta = self.pipe_text_k[pipe_ids]
 
         # Dynamic temperature drop along a pipe
-        exp = - (loss_coeff * dx) / (Cp_w * mf)
-        Tout = Ta + (Tin - Ta) * math.exp(exp)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            exp = - (loss_coeff * dx) / (self.CP_WATER * mf)
+        return Ta + (t_in_k - Ta) * np.exp(exp)
+
+    def _internal_tempflow_calc(self, p_id):
+        if self.pipe_t_in_k is not None:
+            Tin = self.pipe_t_in_k[p_id]
+            Tout = self.pipe_t_out_k[p_id]
+        else:
+            # Static temperature drop
+            Tin = self.t_junction_k[self.topology.pipe_inlet[p_id]]
+            Tout = self._calc_pipe_outlet_temperature(Tin, p_id)
+
+        # Set current inlet temperature of pipe
+        self.t_pipe_inlet_k[p_id] = Tin
 
         # Set pipe outlet temperature
-        net.res_pipe.at[p.index(pipe), 't_to_k'] = Tout
+        self.t_pipe_outlet_k[p_id] = Tout
 
-    def _update_temperature_flow(self, act_pipe):
-        p = self.pipe
-        v = self.valve
-        j = self.junction
+    def _update_temperature_flow(self, p_id):
+        topo = self.topology
 
         # Get connected junctions (direct and indirect)
         # Check direct connection via junction
-        conn_j_id = []
-        conn_j_id.append(self.net.pipe.at[p.index(act_pipe), 'to_junction'])
+        j_id = topo.pipe_outlet[p_id]
         # Check connection via valve
-        conn_v_name = self.net.valve['name'].loc[self.net.valve['from_junction'].isin(conn_j_id)].values.tolist()
-        for valve in conn_v_name:
-            opened = self.net.valve.at[v.index(valve), 'opened']
-            if opened:
-                conn_j_id.append(self.net.valve.at[v.index(valve), 'to_junction'])
+        conn_j_id = np.concatenate(([j_id], topo.valve_outlet[topo.open_valves_out(j_id)]))
 
         # Set temperature at connected junctions
-        conn_j_name = self.net.junction['name'].iloc[conn_j_id].values.tolist()
-        for junction in conn_j_name:
-            self._set_pipe_inlet_temperature_at_junction(junction)
+        for j in conn_j_id:
+            self._set_pipe_inlet_temperature_at_junction(j)
 
         # Get connected hex consumer
-        hex_name = self.net.heat_exchanger['name'].loc[self.net.heat_exchanger['from_junction'].isin(conn_j_id)].values.tolist()
-        for hex in hex_name:
+        hex_id = np.sort(np.concatenate([topo.hex_out(j) for j in conn_j_id]))
+        for h_id in hex_id:
             # Set temperature at the return side of each hex consumer
-            self._calc_consumer_return_temperature(hex)
+            self._calc_consumer_return_temperature(h_id)
+
+    def _set_pipe_inlet_temperature_at_junction(self, j_id):
+        topo = self.topology
 
-    def _set_pipe_inlet_temperature_at_junction(self, junction):
-        j = self.junction
-        p = self.pipe
-        v = self.valve
-        conn_j_id = [j.index(junction)]
-        # Get number of incoming pipes
         # Check connection via valve
-        conn_v_name = self.net.valve['name'].loc[self.net.valve['to_junction'].isin(conn_j_id)].values.tolist()
-        for valve in conn_v_name:
-            opened = self.net.valve.at[v.index(valve), 'opened']
-            if opened:
-                conn_j_id.append(self.net.valve.at[v.index(valve), 'from_junction'])
-        pipes_in = self.net.pipe['name'].loc[self.net.pipe['to_junction'].isin(conn_j_id)].values.tolist()
-
-        mfsum = []
-        mtsum = []
-        if pipes_in:
-            for name in pipes_in:
-                # Do temperature mix weighted by share of incoming mass flow
-                mdot = self.net.res_pipe.at[p.index(name), 'mdot_from_kg_per_s']
-                t_in = self.net.res_pipe.at[p.index(name), 't_to_k']
-                mfsum.append(mdot)
-                mtsum.append(mdot * t_in)
-            Tset = (1 / sum(mfsum)) * sum(mtsum)
-        else:
-            raise AttributeError(f"Junction '{junction}' not connected to a network pipe.")
+        conn_j_id = np.concatenate(([j_id], topo.valve_inlet[topo.open_valves_in(j_id)]))
+        pipes_in = np.sort(np.concatenate([topo.pipes_in(j) for j in conn_j_id]))
+
+        if not pipes_in.size:
+            raise AttributeError(f"Junction '{topo.junction_names[j_id]}' not connected to a network pipe.")
 
-        self.net.res_junction.at[j.index(junction), 't_k'] = Tset
+        # Ignore stagnant pipes and pipes without a temperature (e.g., fed by a dead-end junction)
+        mdot = self.mdot_pipe[pipes_in]
+        t_in = self.t_pipe_outlet_k[pipes_in]
+        valid = (mdot > 0) & np.isfinite(t_in)
+        if not valid.any():
+            return
+
+        # Do temperature mix weighted by share of incoming mass flow
+        mdot = mdot[valid]
+        Tset = (1 / mdot.sum()) * (mdot * t_in[valid]).sum()
+
+        self.t_junction_k[j_id] = Tset
 
     def _update(self):
         hex = self.heat_exchanger
-        ctrl = self.controller
         sink = self.sink
         source = self.source
         v = self.valve
@@ -380,16 +507,16 @@ class DHNetwork:
         self.net.sink.at[sink.index('sink_grid'), 'mdot_kg_per_s'] = self.mdot_grid_set
 
         # Update controller(s)
-        self.net.controller.at[ctrl.index('bypass_ctrl'), 'object'].set_mdot_setpoint(self.mdot_bypass_set)
-        self.net.controller.at[ctrl.index('hex1_ctrl'), 'object'].set_mdot_setpoint(self.mdot_cons1_set)
-        self.net.controller.at[ctrl.index('hex2_ctrl'), 'object'].set_mdot_setpoint(self.mdot_cons2_set)
-        self.net.controller.at[ctrl.index('grid_ctrl'), 'object'].set_mdot_setpoint(self.mdot_grid_set)
+        self._set_mdot_setpoint('bypass_ctrl', self.mdot_bypass_set)
+        self._set_mdot_setpoint('hex1_ctrl', self.mdot_cons1_set)
+        self._set_mdot_setpoint('hex2_ctrl', self.mdot_cons2_set)
+        self._set_mdot_setpoint('grid_ctrl', self.mdot_grid_set)
 
         # Update tank
         if self.tank_installed:
             self.net.sink.at[sink.index('sink_tank'), 'mdot_kg_per_s'] = self.mdot_tank_out_set
             self.net.ext_grid.at[source.index('supply_tank'), 't_k'] = self.T_tank_forward + 273.15
-            self.net.controller.at[ctrl.index('tank_ctrl1'), 'object'].set_mdot_setpoint(self.mdot_tank_out_set)
+            self._set_mdot_setpoint('tank_ctrl1', self.mdot_tank_out_set)
 
         # Update load
         self.net.heat_exchanger.at[hex.index('hex1'), 'qext_w'] = self.Qdot_cons1 * 1000
@@ -573,11 +700,30 @@ class DHNetwork:
 
         self.valve = net.valve['name'].tolist()
 
+    def _set_mdot_setpoint(self, ctrl_name, setpoint):
+        ctrl = self.controller
+
+        if self.flow_control_mode == 'jacobian':
+            valve_ctrl = self.net.controller.at[0, 'object']
+            valve_ctrl.set_mdot_setpoint(setpoint, valve_ctrl.name[ctrl.index(ctrl_name)])
+        else:
+            self.net.controller.at[ctrl.index(ctrl_name), 'object'].set_mdot_setpoint(setpoint)
+
     def _create_flow_control(self):
         net = self.net
         v = self.valve
         s = self.sink
 
+        if self.flow_control_mode == 'jacobian':
+            # create coordinated flow control of all valves
+            MultiValveCtrl(net=net, gids=[v.index(name) for name in ['tank_v1', 'grid_v1', 'bypass', 'sub_v1', 'sub_v2']],
+                           tol=[0.25, 0.25, 0.25, 0.1, 0.1], gain=[-3000, -3000, -2000, -100, -100], name='valve_ctrl')
+
+            self.controller = ['tank_ctrl1', 'grid_ctrl', 'bypass_ctrl', 'hex1_ctrl', 'hex2_ctrl']
+            return
+        elif self.flow_control_mode != 'pid':
+            raise ValueError(f'Unknown flow control mode: {self.flow_control_mode}')
+
         # create supply flow control
         CtrlValve(net=net, gid=v.index('tank_v1'), gain=-3000,
                   # data_source=data_source, profile_name='tank',
@@ -0,0 +1,156 @@
+# Copyright (c) 2021 by ERIGrid 2.0. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+
+from collections import deque
+import numpy as np
+import pandas as pd
+
+
+def _csr(keys, n):
+    '''
+    Compressed sparse row mapping of n junctions to the elements referencing them.
+    :param keys: junction position of each element
+    :param n: number of junctions
+    :return: tuple (indptr, indices), the elements of junction j are indices[indptr[j]:indptr[j+1]]
+    '''
+    keys = np.asarray(keys, dtype=np.intp)
+    indptr = np.zeros(n + 1, dtype=np.intp)
+    np.cumsum(np.bincount(keys, minlength=n), out=indptr[1:])
+    indices = np.argsort(keys, kind='stable')
+    return indptr, indices
+
+
+class NetworkTopology:
+    '''
+    Integer-indexed connectivity of a pandapipes network.
+
+    All elements are referred to by their position in the respective pandapipes table. The
+    structure is built once after the network has been created, only the valve status has to
+    be refreshed when a controller opens or closes a valve.
+
+    Pipes and valves are oriented by their flow direction (inlet -> outlet). By default the
+    flow is assumed to go from the "from" to the "to" junction; call update_flow_direction to
+    orient the elements according to the actual mass flows and to obtain a pipe processing
+    order that is valid for any radial or meshed network.
+    '''
+
+    def __init__(self, net):
+        junction_pos = pd.Series(np.arange(len(net.junction), dtype=np.intp), index=net.junction.index)
+        self.n_junction = len(net.junction)
+
+        # Element endpoints
+        self.pipe_from = junction_pos[net.pipe['from_junction']].values
+        self.pipe_to = junction_pos[net.pipe['to_junction']].values
+        self.valve_from = junction_pos[net.valve['from_junction']].values
+        self.valve_to = junction_pos[net.valve['to_junction']].values
+        self.hex_from = junction_pos[net.heat_exchanger['from_junction']].values
+        self.hex_to = junction_pos[net.heat_exchanger['to_junction']].values
+
+        # Heat exchangers per inlet junction
+        self.junction_hex_out = _csr(self.hex_from, self.n_junction)
+
+        # Element names
+        self.junction_names = net.junction['name'].tolist()
+
+        self.valve_open = None
+        self.update_valve_status(net)
+
+        # Flow orientation and processing order
+        self.pipe_reversed = None
+        self.valve_reversed = None
+        self.pipe_order = None
+        self._orient(np.zeros(len(self.pipe_from), dtype=bool), np.zeros(len(self.valve_from), dtype=bool))
+
+    def update_valve_status(self, net):
+        self.valve_open = net.valve['opened'].values.astype(bool)
+
+    def update_flow_direction(self, mdot_pipe, mdot_valve):
+        '''
+        Orient pipes and valves by the sign of their mass flow. Adjacency and processing order are
+        only recomputed if a flow direction or the valve status has changed.
+        '''
+        pipe_reversed = np.asarray(mdot_pipe) < 0
+        valve_reversed = np.asarray(mdot_valve) < 0
+
+        if (self.pipe_order is not None and np.array_equal(pipe_reversed, self.pipe_reversed) and
+                np.array_equal(valve_reversed, self.valve_reversed) and np.array_equal(self.valve_open, self._order_valve_open)):
+            return
+
+        self._orient(pipe_reversed, valve_reversed)
+        self.pipe_order = self._calc_pipe_order()
+
+    def _orient(self, pipe_reversed, valve_reversed):
+        self.pipe_reversed = pipe_reversed
+        self.valve_reversed = valve_reversed
+        self._order_valve_open = self.valve_open.copy()
+
+        self.pipe_inlet = np.where(pipe_reversed, self.pipe_to, self.pipe_from)
+        self.pipe_outlet = np.where(pipe_reversed, self.pipe_from, self.pipe_to)
+        self.valve_inlet = np.where(valve_reversed, self.valve_to, self.valve_from)
+        self.valve_outlet = np.where(valve_reversed, self.valve_from, self.valve_to)
+
+        # Junction adjacency
+        self.junction_pipes_in = _csr(self.pipe_outlet, self.n_junction)
+        self.junction_pipes_out = _csr(self.pipe_inlet, self.n_junction)
+        self.junction_valves_in = _csr(self.valve_outlet, self.n_junction)
+        self.junction_valves_out = _csr(self.valve_inlet, self.n_junction)
+
+    def _calc_pipe_order(self):
+        '''
+        Order the pipes such that every pipe comes after all elements upstream of its inlet
+        (topological sort of the junctions, Kahn's algorithm). Junctions on a flow cycle are
+        appended in the order of the junction table.
+        '''
+        # Directed edges between junctions (pipes, open valves, heat exchangers)
+        open_valves = self.valve_open
+        src = np.concatenate((self.pipe_inlet, self.valve_inlet[open_valves], self.hex_from))
+        dst = np.concatenate((self.pipe_outlet, self.valve_outlet[open_valves], self.hex_to))
+        indptr, indices = _csr(src, self.n_junction)
+        dst = dst[indices]
+
+        in_degree = np.bincount(dst, minlength=self.n_junction)
+        rank = np.full(self.n_junction, -1, dtype=np.intp)
+        queue = deque(np.flatnonzero(in_degree == 0))
+        n = 0
+        while queue:
+            j = queue.popleft()
+            rank[j] = n
+            n += 1
+            for k in dst[indptr[j]:indptr[j + 1]]:
+                in_degree[k] -= 1
+                if in_degree[k] == 0:
+                    queue.append(k)
+
+        # Junctions on a cycle
+        cyclic = rank < 0
+        rank[cyclic] = n + np.arange(np.count_nonzero(cyclic))
+
+        return np.argsort(rank[self.pipe_inlet], kind='stable')
+
+    @staticmethod
+    def _get(csr, j):
+        indptr, indices = csr
+        return indices[indptr[j]:indptr[j + 1]]
+
+    def pipes_in(self, j):
+        return self._get(self.junction_pipes_in, j)
+
+    def pipes_out(self, j):
+        return self._get(self.junction_pipes_out, j)
+
+    def valves_in(self, j):
+        return self._get(self.junction_valves_in, j)
+
+    def valves_out(self, j):
+        return self._get(self.junction_valves_out, j)
+
+    def hex_out(self, j):
+        return self._get(self.junction_hex_out, j)
+
+    def open_valves_in(self, j):
+        v = self.valves_in(j)
+        return v[self.valve_open[v]]
+
+    def open_valves_out(self, j):
+        v = self.valves_out(j)
+        return v[self.valve_open[v]]
@@ -182,4 +182,149 @@ class CtrlValve(control.basic_controller.Controller):
         # self.line.set_ydata(self.ydata)
         # plt.draw()
         # plt.pause(1e-17)
-        # # time.sleep(0.1)
\ No newline at end of file
+        # # time.sleep(0.1)
+
+class MultiValveCtrl(control.basic_controller.Controller):
+    """
+    Coordinated controller of several control valves. Adjusts the loss coefficients of all valves at once
+    with a Newton step on the vector of mass flow residuals. The Jacobian is estimated by Broyden updates
+    from the previous iterations of the same time step. If a step does not decrease the residual, the
+    remaining iterations of the time step use proportional steps per valve (as CtrlValve), halving the
+    gain of a valve whenever its flow overshoots.
+    """
+
+    def __init__(self, net, gids, mdot_set_kg_per_s=None, tol=0, gain=-1000, in_service=True,
+                 recycle=True, order=0, level=0, **kwargs):
+        super().__init__(net, in_service=in_service, recycle=recycle, order=order, level=level,
+                         initial_powerflow=True, **kwargs)
+
+        # read valve attributes from net
+        self.gid = np.asarray(gids)  # indices of the controlled valves
+        self.loss_coeff = net.valve.loc[self.gid, "loss_coefficient"].values.astype(float)
+        self.opened = net.valve.loc[self.gid, "opened"].values.astype(bool)
+        self.name = net.valve.loc[self.gid, "name"].tolist()
+        n = len(self.gid)
+
+        # specific attributes
+        if mdot_set_kg_per_s is None:
+            mdot_set_kg_per_s = np.zeros(n)
+        self.mdot_set_kg_per_s = np.asarray(mdot_set_kg_per_s, dtype=float) * np.ones(n)
+        self.tolerance = np.asarray(tol, dtype=float) * np.ones(n)  # absolute tolerance
+        self.gain = np.asarray(gain, dtype=float) * np.ones(n)  # proportional gain of the fallback steps
+        self.loss_coeff_min = 0
+        self.loss_coeff_max = 1e6
+        self.i = 0
+
+        # Jacobian d(mdot)/d(loss_coeff), re-initialized at each time step
+        self.jacobian = None
+        self._last_loss_coeff = None
+        self._last_residual = None
+        self._fallback = False
+        self._fallback_gain = None
+        self._fallback_residual = None
+
+    def initialize_control(self, net):
+        """
+        At the beginning of each run_control call reset the Jacobian and the iteration history
+        """
+        self._restart()
+        self._fallback = False
+        self._fallback_residual = None
+        self.i = 0
+
+    def time_step(self, net, time):
+        self._restart()
+        self._fallback = False
+        self._fallback_residual = None
+
+    def _restart(self):
+        self._init_jacobian()
+        self._last_loss_coeff = None
+        self._last_residual = None
+
+    def _get_residual(self, net):
+        mdot = np.nan_to_num(net.res_valve.loc[self.gid, 'mdot_from_kg_per_s'].values)
+        return mdot - self.mdot_set_kg_per_s
+
+    def is_converged(self, net):
+        residual = self._get_residual(net)
+        opened = self.mdot_set_kg_per_s >= 1e-6  # To avoid float issues
+        return bool(np.all(opened == self.opened) and np.all(np.abs(residual[opened]) <= self.tolerance[opened]))
+
+    def write_to_net(self, net):
+        net.valve.loc[self.gid, "loss_coefficient"] = self.loss_coeff
+        net.valve.loc[self.gid, "opened"] = self.opened
+
+    def control_step(self, net):
+        residual = self._get_residual(net)
+
+        # Set valve status, restart the Jacobian if it has changed
+        opened = self.mdot_set_kg_per_s >= 1e-6  # To avoid float issues
+        if np.any(opened != self.opened):
+            self.opened = opened
+            self._restart()
+
+        active = self.opened
+        if np.any(active):
+            # Fall back to proportional steps if the last Newton step did not decrease the residual
+            if self._last_residual is not None and \
+                    np.linalg.norm(residual[active]) >= np.linalg.norm(self._last_residual[active]):
+                self._fallback = True
+
+            if self._fallback:
+                self._set_valve_positions_pid(residual, active)
+            else:
+                self._update_jacobian(residual)
+                self._last_loss_coeff = self.loss_coeff.copy()
+                self._last_residual = residual.copy()
+                self._set_valve_positions(residual, active)
+
+        self.write_to_net(net)
+        self.i += 1
+
+    def _init_jacobian(self):
+        # Flow through a valve at constant pressure drop: mdot ~ loss_coeff^(-1/2)
+        mdot = np.maximum(np.abs(self.mdot_set_kg_per_s), 0.1)
+        self.jacobian = np.diag(-mdot / (2 * np.maximum(self.loss_coeff, 1)))
+
+    def _update_jacobian(self, residual):
+        if self._last_loss_coeff is None:
+            return
+
+        # Broyden's (good) rank-one update
+        d_coeff = self.loss_coeff - self._last_loss_coeff
+        d_residual = residual - self._last_residual
+        norm = d_coeff @ d_coeff
+        if norm > 0:
+            self.jacobian += np.outer(d_residual - self.jacobian @ d_coeff, d_coeff) / norm
+
+    def _set_valve_positions(self, residual, active):
+        jacobian = self.jacobian[np.ix_(active, active)]
+        try:
+            step = np.linalg.solve(jacobian, -residual[active])
+        except np.linalg.LinAlgError:
+            # Fall back to the diagonal of the estimated Jacobian
+            step = -residual[active] / np.where(np.diag(jacobian) != 0, np.diag(jacobian), -1e-3)
+
+        # Limit the step to a doubling of the loss coefficients (the valve characteristic is highly nonlinear)
+        max_step = np.maximum(self.loss_coeff[active], 1)
+        step *= min(1, np.min(max_step / np.maximum(np.abs(step), 1e-12)))
+
+        # Validate limits of loss_coeff
+        self.loss_coeff[active] = np.clip(self.loss_coeff[active] + step, self.loss_coeff_min, self.loss_coeff_max)
+
+    def _set_valve_positions_pid(self, residual, active):
+        # Halve the gain of valves whose flow has overshot since the last proportional step
+        if self._fallback_residual is None:
+            self._fallback_gain = self.gain.copy()
+        else:
+            self._fallback_gain[residual * self._fallback_residual < 0] *= 0.5
+        self._fallback_residual = residual.copy()
+
+        # Proportional control of each valve outside its tolerance (as CtrlValve: output = gain * (mdot_set - mdot))
+        active = active & (np.abs(residual) > self.tolerance)
+        step = self._fallback_gain[active] * -residual[active]
+        self.loss_coeff[active] = np.clip(self.loss_coeff[active] + step, self.loss_coeff_min, self.loss_coeff_max)
+
+    def set_mdot_setpoint(self, setpoint, name):
+        self.mdot_set_kg_per_s[self.name.index(name)] = setpoint
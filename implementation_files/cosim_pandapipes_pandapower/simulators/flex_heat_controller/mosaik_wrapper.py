@@ -13,7 +13,7 @@ META = {
     'models': {
         'SimpleFlexHeatController': {
             'public': True,
-            'params': ['voltage_control_enabled'],
+            'params': ['voltage_control_enabled', 'T_tank_max', 'T_tank_min', 'P_hp_rated', 'hp_operating_threshold'],
             'attrs': [
                 # Input
                 'mdot_HEX1', 'mdot_HEX2', 'T_tank_hot', 'T_hp_cond_in', 'T_hp_cond_out', 'T_hp_evap_in', 'T_hp_evap_out',
@@ -1 +1,3 @@
 from .mosaik_wrapper import TimeSeriesPlayerSim
+from .profile_registry import register_profile, get_profile, clear_profiles
+from .profile_cache import load_csv_profile
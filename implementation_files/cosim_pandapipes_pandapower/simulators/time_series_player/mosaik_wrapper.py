@@ -1,23 +1,33 @@
 # Copyright (c) 2021 by ERIGrid 2.0. All rights reserved.
 # Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
 
+import copy
 from itertools import count
-from .simulator import TimeSeriesPlayer
+from .simulator import TimeSeriesPlayer, MultiTimeSeriesPlayer
 from mosaik_api import Simulator
-from typing import Dict
+from typing import Dict, Union
 
 META = {
     'models': {
         'TimeSeriesPlayer': {
             'public': True,
             'params': [
-                't_start', 'series', 'fieldname', 'interp_method', 'scale'
+                't_start', 'series', 'fieldname', 'interp_method', 'scale', 'memmap_path', 'source_file', 'block_steps'
             ],
             'attrs': [
                 # Output
                 'out',
             ],
         },
+        'MultiTimeSeriesPlayer': {
+            'public': True,
+            'params': [
+                't_start', 'series', 'fieldnames', 'interp_method', 'scale'
+            ],
+            'attrs': [
+                # Outputs (one per field, declared with parameter "fieldnames" when starting the simulator)
+            ],
+        },
     },
 }
 
@@ -33,16 +43,21 @@ class TimeSeriesPlayerSim(Simulator):
 
         # Per-entity dicts
         self.eid_counters = {}
-        self.simulators: Dict[str, TimeSeriesPlayer] = {}
+        self.simulators: Dict[str, Union[TimeSeriesPlayer, MultiTimeSeriesPlayer]] = {}
         self.entityparams = {}
         self.output_vars = {'out'}
         self.input_vars = {}
 
-    def init(self, sid, step_size = 10, eid_prefix = 'TimeSeriesPlayer'):
+    def init(self, sid, step_size = 10, eid_prefix = 'TimeSeriesPlayer', fieldnames = None):
 
         self.step_size = step_size
         self.eid_prefix = eid_prefix
 
+        if fieldnames is not None:
+            # Output attributes of the MultiTimeSeriesPlayer entities of this simulator.
+            self.meta = copy.deepcopy(self.meta)
+            self.meta['models']['MultiTimeSeriesPlayer']['attrs'] = list(fieldnames)
+
         return self.meta
 
     def create(self, num, model, **model_params):
@@ -53,7 +68,10 @@ class TimeSeriesPlayerSim(Simulator):
             eid = '%s_%s' % (self.eid_prefix, next(counter))
 
             self.entityparams[eid] = model_params
-            esim = TimeSeriesPlayer(step_size = self.step_size,**model_params)
+            if model == 'MultiTimeSeriesPlayer':
+                esim = MultiTimeSeriesPlayer(step_size = self.step_size,**model_params)
+            else:
+                esim = TimeSeriesPlayer(step_size = self.step_size,**model_params)
 
             self.simulators[eid] = esim
 
@@ -80,6 +98,13 @@ class TimeSeriesPlayerSim(Simulator):
             requests = outputs.get(eid, [])
             mydata = {}
 
+            if isinstance(esim, MultiTimeSeriesPlayer):
+                try:
+                    data[eid] = {attr: esim.get_value(attr) for attr in requests}
+                except KeyError as e:
+                    raise AttributeError(f"TimeSeriesPlayerSimulator {eid} has no attribute {e.args[0]}.") from None
+                continue
+
             for attr in requests:
                 if attr in self.input_vars or attr in self.output_vars:
                     mydata[attr] = getattr(esim, attr)
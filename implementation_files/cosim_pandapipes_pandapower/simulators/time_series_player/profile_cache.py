@@ -0,0 +1,138 @@
+# Copyright (c) 2021 by ERIGrid 2.0. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+'''
+Binary cache for profiles stored as CSV files.
+
+On first use, a CSV profile (datetime index in the first column, numeric columns) is parsed
+and stored as NumPy arrays (index as datetime64, values column-major) plus a JSON file with
+the column names and the identity of the source file. Later loads memory-map these arrays.
+The cache is rebuilt if the size or modification time of the source file has changed and
+its content hash differs, or if it cannot be read. Cache files are written to temporary
+files and moved into place, such that concurrent readers never see partial files.
+'''
+
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+import numpy as np
+import pandas as pd
+
+CACHE_VERSION = 1
+
+
+def _file_hash(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _cache_paths(cache_dir, path):
+    cache_dir = pathlib.Path(cache_dir)
+    return {
+        'meta': cache_dir / (path.stem + '.json'),
+        'index': cache_dir / (path.stem + '.index.npy'),
+        'values': cache_dir / (path.stem + '.values.npy'),
+    }
+
+
+def _write_atomic(target, write):
+    '''
+    Write a file via a temporary file in the same directory, which replaces the target when complete.
+    '''
+    fd, tmp_path = tempfile.mkstemp(dir=target.parent, prefix=target.name, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, target)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _write_meta(meta_path, meta):
+    _write_atomic(meta_path, lambda f: f.write(json.dumps(meta).encode()))
+
+
+def _is_valid(meta_path, path, stat):
+    '''
+    Check if the cache is up-to-date with the source file. If only the modification time
+    has changed but not the content, the stored modification time is updated.
+    '''
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+
+    if not isinstance(meta, dict) or meta.get('version') != CACHE_VERSION:
+        return False
+
+    if meta.get('size') == stat.st_size and meta.get('mtime_ns') == stat.st_mtime_ns:
+        return True
+
+    if meta.get('size') == stat.st_size and meta.get('sha1') == _file_hash(path):
+        meta['mtime_ns'] = stat.st_mtime_ns
+        _write_meta(meta_path, meta)
+        return True
+
+    return False
+
+
+def _write_cache(paths, path, stat):
+    series = pd.read_csv(path, index_col=0, parse_dates=True)
+
+    paths['meta'].parent.mkdir(parents=True, exist_ok=True)
+    index = series.index.values.astype('datetime64[ns]')
+    values = np.asfortranarray(series.to_numpy(dtype=np.float64))
+    _write_atomic(paths['index'], lambda f: np.save(f, index))
+    _write_atomic(paths['values'], lambda f: np.save(f, values))
+
+    # Written last, marks the cache as complete.
+    meta = {
+        'version': CACHE_VERSION,
+        'source': os.fspath(path),
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'sha1': _file_hash(path),
+        'index_name': series.index.name,
+        'columns': list(series.columns),
+    }
+    _write_meta(paths['meta'], meta)
+
+
+def _read_cache(paths):
+    with open(paths['meta']) as f:
+        meta = json.load(f)
+
+    index = pd.DatetimeIndex(np.load(paths['index']), name=meta['index_name'])
+    values = np.load(paths['values'], mmap_mode='r')
+
+    return pd.DataFrame(values, index=index, columns=meta['columns'], copy=False)
+
+
+def load_csv_profile(path, cache_dir=None):
+    '''
+    Load a CSV profile as data frame, using a binary cache.
+    :param path: path of the CSV file
+    :param cache_dir: cache directory (default: directory ".cache" next to the CSV file)
+    :return: data frame with datetime index, backed by read-only memory-mapped values
+    '''
+    path = pathlib.Path(path)
+    if cache_dir is None:
+        cache_dir = path.parent / '.cache'
+
+    paths = _cache_paths(cache_dir, path)
+    stat = path.stat()
+
+    if _is_valid(paths['meta'], path, stat):
+        try:
+            return _read_cache(paths)
+        except (OSError, ValueError, KeyError, TypeError):
+            pass  # Corrupt or unreadable cache, rebuild it
+
+    _write_cache(paths, path, stat)
+    return _read_cache(paths)
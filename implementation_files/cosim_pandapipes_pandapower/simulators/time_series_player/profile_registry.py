@@ -0,0 +1,129 @@
+# Copyright (c) 2021 by ERIGrid 2.0. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+'''
+Process-wide registry of profiles shared by all time series players.
+
+Each registered profile is resampled once per step size and interpolation method, and
+aligned once per start time. Players only hold read-only views of a single column.
+'''
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.offsets import DateOffset
+
+_profiles = {}  # Registered profiles (name -> data frame)
+_resampled = {}  # Resampled profiles ((name, step_size, interp_method) -> data frame)
+_aligned = {}  # Values at the simulation time steps ((name, step_size, interp_method, t_start) -> (values, missing))
+
+
+def register_profile(name, series):
+    '''
+    Register a profile (data frame with a datetime index). Registering a different data frame
+    under the same name replaces the profile and all data derived from it.
+    '''
+    if _profiles.get(name) is series:
+        return
+
+    _profiles[name] = series
+    for cache in (_resampled, _aligned):
+        for key in [key for key in cache if key[0] == name]:
+            del cache[key]
+
+
+def get_profile(name):
+    try:
+        return _profiles[name]
+    except KeyError:
+        raise KeyError('Profile "{0}" is not registered.'.format(name)) from None
+
+
+def clear_profiles():
+    _profiles.clear()
+    _resampled.clear()
+    _aligned.clear()
+
+
+def resample_series(series, step_size, interp_method):
+    '''
+    Add the time steps of the given step size to the index of a time series and interpolate.
+    '''
+    # Retrieve original index from time series.
+    index = series.index
+
+    # Calculate index required for given step size.
+    step_size_index = pd.date_range(index[0], index.values[-1], freq=DateOffset(seconds=step_size))
+
+    # Check if original index and index required for step size are the same.
+    if not index.equals(step_size_index):
+        # Re-index and interpolate the time series.
+        new_index = index.union(step_size_index)
+        series = series.reindex(new_index).interpolate(method=interp_method)
+
+    return series
+
+
+def align_to_steps(series, t_start, step_size):
+    '''
+    Align the values of a (resampled) time series to the simulation time steps, such that the
+    values at simulation time t are found in row t // step_size.
+    :return: tuple (values, missing), missing flags time steps not available in the time series (None if all are available)
+    '''
+    index = series.index
+    step_index = pd.date_range(t_start, index[-1], freq=DateOffset(seconds=step_size))
+    positions = index.get_indexer(step_index)
+
+    values = series.to_numpy(dtype=np.float64)[positions]
+
+    missing = None
+    if (positions < 0).any():
+        missing = positions < 0
+        values[missing] = np.nan
+
+    return values, missing
+
+
+def get_resampled_profile(name, step_size, interp_method):
+    key = (name, step_size, interp_method)
+    if key not in _resampled:
+        _resampled[key] = resample_series(get_profile(name), step_size, interp_method)
+    return _resampled[key]
+
+
+def _get_aligned(name, t_start, step_size, interp_method):
+    key = (name, step_size, interp_method, pd.to_datetime(t_start))
+    if key not in _aligned:
+        values, missing = align_to_steps(get_resampled_profile(name, step_size, interp_method), key[3], step_size)
+
+        # Column-major storage, every column is a contiguous view
+        values = np.asfortranarray(values)
+        values.flags.writeable = False
+        columns = {column: i for i, column in enumerate(get_profile(name).columns)}
+        _aligned[key] = (values, missing, columns)
+
+    return _aligned[key]
+
+
+def get_step_values(name, fieldname, t_start, step_size, interp_method):
+    '''
+    Read-only values of a single profile column at the simulation time steps.
+    :return: tuple (values, missing), see align_to_steps
+    '''
+    values, missing, columns = _get_aligned(name, t_start, step_size, interp_method)
+    return values[:, columns[fieldname]], missing
+
+
+def get_step_table(name, fieldnames, t_start, step_size, interp_method):
+    '''
+    Read-only values of several profile columns at the simulation time steps, one row per time step.
+    :param fieldnames: list of column names (None for all columns of the profile)
+    :return: tuple (values, missing, fieldnames), see align_to_steps
+    '''
+    values, missing, columns = _get_aligned(name, t_start, step_size, interp_method)
+
+    if fieldnames is None:
+        fieldnames = list(columns)
+
+    # Row-major copy, the values of all columns at one time step are contiguous
+    values = np.ascontiguousarray(values[:, [columns[fieldname] for fieldname in fieldnames]])
+    values.flags.writeable = False
+    return values, missing, list(fieldnames)
@@ -1,10 +1,12 @@
 # Copyright (c) 2021 by ERIGrid 2.0. All rights reserved.
 # Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
 
+import numpy as np
 import pandas as pd
-from pandas.tseries.offsets import DateOffset
 from dataclasses import dataclass
 import datetime
+from . import profile_registry
+from .streaming import StreamingProfile
 
 @dataclass
 class TimeSeriesPlayer:
@@ -18,13 +20,21 @@ class TimeSeriesPlayer:
     step_size: int = None
     interp_method: str = 'linear'
     scale: float = 1.
+    memmap_path: str = None  # Optional file for memory-mapped storage of the precomputed values (e.g., for long profiles).
+    source_file: str = None  # CSV file to stream the time series from in chunks (instead of series).
+    block_steps: int = 1440  # Number of time steps interpolated at once when streaming.
 
     # Variables
     ## Internal
     cur_t: datetime.datetime = None
 
     ## Input
-    series: pd.DataFrame() = None
+    series: pd.DataFrame() = None  # Time series or name of a profile in the profile registry
+
+    ## Precomputed values at the simulation time steps (t_start + k * step_size)
+    values: np.ndarray = None
+    missing: np.ndarray = None
+    stream: StreamingProfile = None
 
     ## Output
     out: float = None
@@ -39,20 +49,44 @@ class TimeSeriesPlayer:
         self.t_start = pd.to_datetime(self.t_start)
         self.cur_t = self.t_start
 
-        # Retrieve original index from time series.
-        index = self.series[self.fieldname].index
-        
-        # Calculate index required for given step size.
-        step_size_index = pd.date_range(index[0], index.values[-1], freq=DateOffset(seconds=self.step_size))
-
-        # Check if original index and index required for step size are the same.
-        if not index.equals(step_size_index):
-            # Re-index and interpolate the time series.
-            new_index = index.union(step_size_index)
-            self.series = self.series.reindex(new_index).interpolate(method=self.interp_method)
+        if self.source_file is not None:
+            # Streaming mode, values are interpolated block by block during the simulation.
+            self.stream = StreamingProfile(self.source_file, self.fieldname, self.t_start, self.step_size,
+                                           self.interp_method, self.block_steps)
+            assert self.stream.get_value(0) is not None, "Simulation starting date: \"{0}\", is not in time series input.".format(self.t_start)
+            return
+
+        if isinstance(self.series, str):
+            # Shared profile, resampled only once for all players.
+            profile_name = self.series
+            self.series = profile_registry.get_resampled_profile(profile_name, self.step_size, self.interp_method)
+        else:
+            profile_name = None
+            self.series = profile_registry.resample_series(self.series[[self.fieldname]], self.step_size, self.interp_method)
 
         assert self.t_start in self.series.index, "Simulation starting date: \"{0}\", is not in time series input.".format(self.t_start)
 
+        self.precompute_values(profile_name)
+
+
+    def precompute_values(self, profile_name=None):
+        '''
+        Align the values of the time series to the simulation time steps, such that the value
+        at simulation time t is found at position t // step_size.
+        '''
+        if profile_name is not None:
+            values, self.missing = profile_registry.get_step_values(
+                profile_name, self.fieldname, self.t_start, self.step_size, self.interp_method)
+        else:
+            values, self.missing = profile_registry.align_to_steps(
+                self.series[self.fieldname], self.t_start, self.step_size)
+
+        if self.memmap_path is None:
+            self.values = values
+        else:
+            np.save(self.memmap_path, values)
+            self.values = np.load(self.memmap_path, mmap_mode='r')
+
 
     def step_single(self, t):
             '''
@@ -60,6 +94,19 @@ class TimeSeriesPlayer:
             input: simulation time
             output: time series value
             '''
+            k, offset = divmod(t, self.step_size)
+
+            if self.stream is not None:
+                value = self.stream.get_value(k) if offset == 0 and k >= 0 else None
+                if value is None:
+                    raise RuntimeError('timestamp not available')
+                self.out = self.scale * value
+                return
+
+            if offset == 0 and 0 <= k < len(self.values) and (self.missing is None or not self.missing[k]):
+                self.out = self.scale * self.values[k]
+                return
+
             self.cur_t = self.t_start + pd.Timedelta(seconds=t)
 
             if self.cur_t in self.series.index:
@@ -68,3 +115,85 @@ class TimeSeriesPlayer:
             else:
                 raise RuntimeError('timestamp not available')
 
+
+
+@dataclass
+class MultiTimeSeriesPlayer:
+    '''
+    Time series simulator that plays several columns of a given time series at the given date.
+    The values of all columns are stored in one array and updated at once.
+    '''
+
+    # Parameters
+    t_start: datetime.datetime = None
+    fieldnames: list = None  # Names of the fields in the dataframe to use (default: all fields).
+    step_size: int = None
+    interp_method: str = 'linear'
+    scale: float = 1.
+
+    # Variables
+    ## Internal
+    cur_t: datetime.datetime = None
+    columns: dict = None  # Position of each field in the output vector
+
+    ## Input
+    series: pd.DataFrame() = None  # Time series or name of a profile in the profile registry
+
+    ## Precomputed values at the simulation time steps (one row per time step, one column per field)
+    values: np.ndarray = None
+    missing: np.ndarray = None
+
+    ## Output
+    out: np.ndarray = None  # Values of all fields
+
+
+    def __post_init__(self):
+        self.sim_check()
+        self.step_single(0)
+
+
+    def sim_check(self):
+        self.t_start = pd.to_datetime(self.t_start)
+        self.cur_t = self.t_start
+
+        if isinstance(self.series, str):
+            # Shared profile, resampled only once for all players.
+            profile_name = self.series
+            self.series = profile_registry.get_resampled_profile(profile_name, self.step_size, self.interp_method)
+            self.values, self.missing, self.fieldnames = profile_registry.get_step_table(
+                profile_name, self.fieldnames, self.t_start, self.step_size, self.interp_method)
+        else:
+            if self.fieldnames is None:
+                self.fieldnames = list(self.series.columns)
+            self.series = profile_registry.resample_series(self.series[self.fieldnames], self.step_size, self.interp_method)
+            self.values, self.missing = profile_registry.align_to_steps(
+                self.series[self.fieldnames], self.t_start, self.step_size)
+
+        assert self.t_start in self.series.index, "Simulation starting date: \"{0}\", is not in time series input.".format(self.t_start)
+
+        self.columns = {fieldname: i for i, fieldname in enumerate(self.fieldnames)}
+
+
+    def get_value(self, fieldname):
+        return float(self.out[self.columns[fieldname]])
+
+
+    def step_single(self, t):
+            '''
+            Method to update the time series simulator output
+            input: simulation time
+            output: time series values
+            '''
+            k, offset = divmod(t, self.step_size)
+
+            if offset == 0 and 0 <= k < len(self.values) and (self.missing is None or not self.missing[k]):
+                self.out = self.scale * self.values[k]
+                return
+
+            self.cur_t = self.t_start + pd.Timedelta(seconds=t)
+
+            if self.cur_t in self.series.index:
+                self.out = self.scale * self.series.loc[self.cur_t, self.fieldnames].to_numpy(dtype=np.float64)
+
+            else:
+                raise RuntimeError('timestamp not available')
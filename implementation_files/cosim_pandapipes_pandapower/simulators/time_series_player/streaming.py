@@ -0,0 +1,92 @@
+# Copyright (c) 2021 by ERIGrid 2.0. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be found in the LICENSE file.
+'''
+Streaming access to long time series stored in CSV files.
+
+The source is read in time-ordered chunks and interpolated lazily, one block of simulation
+time steps at a time. Only a bounded window of source rows is kept in memory. The window
+includes a few source rows before and after each block, so that the interpolation (including
+pchip, which depends on the neighbouring points) gives the same result as interpolating the
+whole series at once.
+'''
+
+import numpy as np
+import pandas as pd
+
+# Number of source rows kept on either side of a block of time steps for the interpolation.
+CONTEXT_ROWS = 3
+
+
+class StreamingProfile:
+    '''
+    Values of one column of a CSV time series at the simulation time steps t_start + k * step_size.
+    '''
+
+    def __init__(self, path, fieldname, t_start, step_size, interp_method='linear', block_steps=1440, read_rows=10000):
+        self.path = path
+        self.fieldname = fieldname
+        self.t_start = pd.to_datetime(t_start)
+        self.step_size = pd.Timedelta(seconds=step_size)
+        self.interp_method = interp_method
+        self.block_steps = block_steps  # Number of time steps interpolated at once
+        self.read_rows = read_rows  # Number of source rows read at once
+
+        self.block_start = None  # First time step of the current block
+        self.values = None  # Values of the current block
+        self._open()
+
+    def _open(self):
+        index_name = pd.read_csv(self.path, nrows=0).columns[0]
+        self._reader = pd.read_csv(self.path, index_col=0, parse_dates=True, usecols=[index_name, self.fieldname],
+                                   chunksize=self.read_rows)
+        self._window = None  # Source rows currently in memory
+        self._exhausted = False
+        self._origin = None  # First time stamp of the source (origin of the resampling grid)
+
+    def _read(self):
+        try:
+            chunk = next(self._reader)[self.fieldname]
+        except StopIteration:
+            self._exhausted = True
+            return
+
+        if self._origin is None:
+            self._origin = chunk.index[0]
+        self._window = chunk if self._window is None else pd.concat((self._window, chunk))
+
+    def get_value(self, k):
+        '''
+        Value at time step k, None if not available in the source.
+        '''
+        if self.block_start is None or not self.block_start <= k < self.block_start + self.block_steps:
+            if self.block_start is not None and k < self.block_start:
+                # Rewind (only needed if time steps are requested out of order)
+                self._open()
+            self._load_block(k - k % self.block_steps)
+
+        value = self.values[k - self.block_start]
+        return None if np.isnan(value) else value
+
+    def _load_block(self, block_start):
+        step_times = self.t_start + self.step_size * np.arange(block_start, block_start + self.block_steps)
+
+        # Read until the window covers the block and the context after it.
+        while not self._exhausted and (self._window is None or
+                                       (self._window.index > step_times[-1]).sum() < CONTEXT_ROWS):
+            self._read()
+
+        # Drop source rows that are not needed as context before the block.
+        first = max(np.searchsorted(self._window.index, step_times[0], side='right') - 1 - CONTEXT_ROWS, 0)
+        window = self._window.iloc[first:]
+        self._window = window
+
+        self.block_start = block_start
+        self.values = self._interpolate(window, step_times)
+
+    def _interpolate(self, window, step_times):
+        # Resampling grid anchored at the first source time stamp, as for a fully loaded series
+        offset = -((self._origin - window.index[0]) // self.step_size)
+        grid = pd.date_range(self._origin + offset * self.step_size, window.index[-1], freq=self.step_size)
+
+        series = window.reindex(window.index.union(grid)).interpolate(method=self.interp_method)
+        return series.reindex(step_times).to_numpy(dtype=np.float64)
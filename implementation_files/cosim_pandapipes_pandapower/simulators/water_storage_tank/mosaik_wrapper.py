@@ -5,7 +5,6 @@ from itertools import count
 from .simulator import WaterStorageTank
 from mosaik_api import Simulator
 from typing import Dict
-from statistics import mean
 
 META = {
     'models': {
@@ -13,7 +12,7 @@ META = {
             'public': True,
             'params': [
                 'INNER_HEIGHT', 'INNER_DIAMETER', 'INSULATION_THICKNESS', 'STEEL_THICKNESS', 'NB_LAYERS',
-                'T_volume_initial','dt'
+                'T_volume_initial','dt', 'solver', 'substepping', 'max_courant'
                 ],
             'attrs': [
                 # Input
@@ -108,7 +107,7 @@ class StratifiedWaterStorageTankSimulator(Simulator):
             for attr in requests:
                 if attr in self.input_vars or attr in self.output_vars:
                     if attr == 'T_avg':
-                        mydata[attr] = mean(esim.Layers_temperature_dict.values())
+                        mydata[attr] = float(esim.Layers_temperature.mean())
                     elif 'T' in attr:
                         mydata[attr] = getattr(esim, attr)  # Convert local degK to degC for sending into the co-simulation flow
                     else:
@@ -3,6 +3,7 @@
 
 from dataclasses import dataclass, field
 import numpy as np
+from scipy.linalg import solve_banded
 from ..util import KBASE
 
 
@@ -18,6 +19,9 @@ class WaterStorageTank:
 
     # Simulation parameters
     dt: float = 1.0  # Time per step, integration resolution - [s]
+    solver: str = 'explicit'  # Integration scheme, 'explicit' (forward Euler) or 'implicit' (backward Euler, stable for large dt)
+    substepping: bool = False  # Split dt into stable internal time steps (explicit solver only)
+    max_courant: float = 0.9  # Maximum internal time step relative to the stability limit of the explicit solver - [-]
 
     # Unit parameters
     # # Geometry
@@ -69,7 +73,8 @@ class WaterStorageTank:
 
     # Internal variables
     # # State
-    Layers_temperature_dict: dict = field(default_factory=dict)
+    Layers_temperature: np.ndarray = field(init=False)  # Layer temperatures, top to bottom - [degC]
+    n_substeps: int = 1  # Number of internal time steps of the last step - [-]
     Layers_list: list = field(default_factory=list)
 
     # # Input
@@ -140,150 +145,86 @@ class WaterStorageTank:
         self.LAYER_WATER_MASS = self.WATER_MASS / self.NB_LAYERS
         self.LAYER_WALL_AREA = 2 * np.pi * self.INNER_RADIUS**2 + 2 * np.pi * self.INNER_RADIUS * self.LAYER_LENGTH
 
-        for layer in self.Layers_list:
-            self.Layers_temperature_dict[layer] = self.T_volume_initial
+        self.Layers_temperature = np.full(len(self.Layers_list), self.T_volume_initial, dtype=float)
 
+        # Heat capacity of a layer - [J/degK]
+        self.LAYER_HEAT_CAPACITY = self.LAYER_WATER_MASS * self.Cp_water
+
+        # Conduction between neighbouring layers and losses through the wall - [W/degK]
+        conductance = (self.LAMBDA_WALL + self.DELTA_LAMBDA) * self.CROSS_SECTIONAL_WATER_AREA / self.LAYER_LENGTH
+        wall_conductance = self.U_WALL * self.LAYER_WALL_AREA
+
+        # Tridiagonal operator in banded storage (rows: upper, main and lower diagonal)
+        self.conduction_operator = np.zeros((3, len(self.Layers_list)))
+        self.conduction_operator[0, 1:] = conductance
+        self.conduction_operator[2, :-1] = conductance
+        self.conduction_operator[1] = - self.conduction_operator[0] - self.conduction_operator[2] - wall_conductance
+        self.wall_loss_source = np.full(len(self.Layers_list), wall_conductance * self.T_environment)
+
+    @property
+    def Layers_temperature_dict(self):
+        return dict(enumerate(self.Layers_temperature))
 
     def step_single(self):
-        # Charging mode
-        if self.mdot_ch_in > 0:
+        if self.mdot_ch_in < 0 or self.mdot_dis_out > 0:
+            raise ValueError('Unknown value for incoming mass flow mdot_ch_in: {0} and outgoing mass flow mdot_dis_out: {1}'.format(self.mdot_ch_in, self.mdot_dis_out))
 
+        # Charging mode (top to bottom)
+        if self.mdot_ch_in > 0:
             self.mdot_ch_out = - self.mdot_ch_in
-            self.mdot_down = self.mdot_ch_in
-            self.mdot_up = 0.0
-
-            for layer in self.Layers_list:
-                # Top of the tank boundary layer
-                if layer == 0:
-                    self.Layers_temperature_dict[layer] = (
-                        (
-                            (self.LAMBDA_WALL + self.DELTA_LAMBDA) * self.CROSS_SECTIONAL_WATER_AREA / self.LAYER_LENGTH * (self.Layers_temperature_dict[layer+1] - self.Layers_temperature_dict[layer]) \
-                            + self.U_WALL * self.LAYER_WALL_AREA * (self.T_environment - self.Layers_temperature_dict[layer])
-                            - self.mdot_down * self.Cp_water * self.Layers_temperature_dict[layer]
-                            + self.mdot_ch_in * self.Cp_water * self.T_ch_in
-                            ) / (self.LAYER_WATER_MASS * self.Cp_water)
-                        ) * self.dt + self.Layers_temperature_dict[layer]
-
-
-                    # Intermediate layers
-                elif (layer != 0 and layer != self.Layers_list[-1:][0]):
-
-                    self.Layers_temperature_dict[layer] = (
-                        (
-                            (self.LAMBDA_WALL + self.DELTA_LAMBDA) * self.CROSS_SECTIONAL_WATER_AREA / self.LAYER_LENGTH * (self.Layers_temperature_dict[layer+1] - self.Layers_temperature_dict[layer]) \
-                            +(self.LAMBDA_WALL + self.DELTA_LAMBDA) * self.CROSS_SECTIONAL_WATER_AREA / self.LAYER_LENGTH * (self.Layers_temperature_dict[layer-1] - self.Layers_temperature_dict[layer]) \
-                            + self.U_WALL * self.LAYER_WALL_AREA * (self.T_environment - self.Layers_temperature_dict[layer])
-                            + self.mdot_down * self.Cp_water * self.Layers_temperature_dict[layer-1]
-                            - self.mdot_down * self.Cp_water * self.Layers_temperature_dict[layer]
-                            ) / (self.LAYER_WATER_MASS * self.Cp_water)
-                        ) * self.dt + self.Layers_temperature_dict[layer]
-
-
-                # Bottom of the tank boundary layer
-                elif layer == self.Layers_list[-1:][0]:
-
-                    self.Layers_temperature_dict[layer] = (
-                        (
-                            (self.LAMBDA_WALL + self.DELTA_LAMBDA) * self.CROSS_SECTIONAL_WATER_AREA / self.LAYER_LENGTH * (self.Layers_temperature_dict[layer-1] - self.Layers_temperature_dict[layer]) \
-                            + self.U_WALL * self.LAYER_WALL_AREA * (self.T_environment - self.Layers_temperature_dict[layer])
-                            + self.mdot_down * self.Cp_water * self.Layers_temperature_dict[layer-1]
-                            + self.mdot_ch_out * self.Cp_water * self.Layers_temperature_dict[layer]
-                            ) / (self.LAYER_WATER_MASS * self.Cp_water)
-                        ) * self.dt + self.Layers_temperature_dict[layer]
-
-                else:
-                    raise ValueError("Layer {0} is unknown".format(layer))
-
-                self.T_out = self.Layers_temperature_dict[self.Layers_list[-1:][0]]
-
-
-        # Discharging mode (can be at the same time)
+        self.mdot_down = self.mdot_ch_in
+
+        # Discharging mode (bottom to top, can be at the same time)
         if self.mdot_dis_out < 0:
             self.mdot_dis_in = - self.mdot_dis_out
-            self.mdot_up = - self.mdot_dis_out
-            self.mdot_down = 0.0
-
-            reverse_layers_list = reversed(self.Layers_list)
-
-            for layer in reverse_layers_list:
-                # Bottom of the tank boundary layer
-                if layer == self.Layers_list[-1:][0]:
-
-                    self.Layers_temperature_dict[layer] = (
-                        (
-                            (self.LAMBDA_WALL + self.DELTA_LAMBDA) * self.CROSS_SECTIONAL_WATER_AREA / self.LAYER_LENGTH * (self.Layers_temperature_dict[layer-1] - self.Layers_temperature_dict[layer]) \
-                            + self.U_WALL * self.LAYER_WALL_AREA * (self.T_environment - self.Layers_temperature_dict[layer])
-                            - self.mdot_up * self.Cp_water * self.Layers_temperature_dict[layer]
-                            - self.mdot_dis_out * self.Cp_water * self.T_dis_in
-                            ) / (self.LAYER_WATER_MASS * self.Cp_water)
-                        ) * self.dt + self.Layers_temperature_dict[layer]
-
-                # Intermediate layers
-                elif (layer != 0 and layer != self.Layers_list[-1:][0]):
-                    self.Layers_temperature_dict[layer] =  (
-                        (
-                            (self.LAMBDA_WALL + self.DELTA_LAMBDA) * self.CROSS_SECTIONAL_WATER_AREA / self.LAYER_LENGTH * (self.Layers_temperature_dict[layer+1] - self.Layers_temperature_dict[layer]) \
-                            +(self.LAMBDA_WALL + self.DELTA_LAMBDA) * self.CROSS_SECTIONAL_WATER_AREA / self.LAYER_LENGTH * (self.Layers_temperature_dict[layer-1] - self.Layers_temperature_dict[layer]) \
-                            + self.U_WALL * self.LAYER_WALL_AREA * (self.T_environment - self.Layers_temperature_dict[layer])
-                            + self.mdot_up * self.Cp_water * self.Layers_temperature_dict[layer+1]
-                            - self.mdot_up * self.Cp_water * self.Layers_temperature_dict[layer]
-                            ) / (self.LAYER_WATER_MASS * self.Cp_water)
-                        ) * self.dt + self.Layers_temperature_dict[layer]
-
-                # Top of the tank boundary layer
-                elif layer == 0:
-                    self.Layers_temperature_dict[layer] = (
-                        (
-                            (self.LAMBDA_WALL + self.DELTA_LAMBDA) * self.CROSS_SECTIONAL_WATER_AREA / self.LAYER_LENGTH * (self.Layers_temperature_dict[layer+1] - self.Layers_temperature_dict[layer]) \
-                            + self.U_WALL * self.LAYER_WALL_AREA * (self.T_environment - self.Layers_temperature_dict[layer])
-                            + self.mdot_up * self.Cp_water * self.Layers_temperature_dict[layer+1]
-                            - self.mdot_dis_in * self.Cp_water * self.Layers_temperature_dict[layer]
-                            ) / (self.LAYER_WATER_MASS * self.Cp_water)
-                        ) * self.dt + self.Layers_temperature_dict[layer]
-                else:
-                    raise ValueError("Layer {0} is unknown".format(layer))
-
-                self.T_out = self.Layers_temperature_dict[self.Layers_list[-1:][0]]
-
-
-        # Stand-by mode
-        elif self.mdot_ch_in == 0 and self.mdot_dis_out == 0:
-
-            for layer in self.Layers_list:
-                if layer == 0:
-                    self.Layers_temperature_dict[layer] = (
-                        (
-                            (self.LAMBDA_WALL + self.DELTA_LAMBDA) * self.CROSS_SECTIONAL_WATER_AREA / self.LAYER_LENGTH * (self.Layers_temperature_dict[layer+1] - self.Layers_temperature_dict[layer]) \
-                            + self.U_WALL * self.LAYER_WALL_AREA * (self.T_environment - self.Layers_temperature_dict[layer])
-                            ) / (self.LAYER_WATER_MASS * self.Cp_water)
-                        ) * self.dt + self.Layers_temperature_dict[layer]
-
-                elif (layer != 0 and layer != self.Layers_list[-1:][0]):
-                    self.Layers_temperature_dict[layer] =  (
-                        (
-                            (self.LAMBDA_WALL + self.DELTA_LAMBDA) * self.CROSS_SECTIONAL_WATER_AREA / self.LAYER_LENGTH * (self.Layers_temperature_dict[layer+1] - self.Layers_temperature_dict[layer]) \
-                            +(self.LAMBDA_WALL + self.DELTA_LAMBDA) * self.CROSS_SECTIONAL_WATER_AREA / self.LAYER_LENGTH * (self.Layers_temperature_dict[layer-1] - self.Layers_temperature_dict[layer]) \
-                            + self.U_WALL * self.LAYER_WALL_AREA * (self.T_environment - self.Layers_temperature_dict[layer]) \
-                            ) / (self.LAYER_WATER_MASS * self.Cp_water)
-                        ) * self.dt + self.Layers_temperature_dict[layer]
-
-                elif layer == self.Layers_list[-1:][0]:
-                    self.Layers_temperature_dict[layer] = (
-                        (
-                            (self.LAMBDA_WALL + self.DELTA_LAMBDA) * self.CROSS_SECTIONAL_WATER_AREA / self.LAYER_LENGTH * (self.Layers_temperature_dict[layer-1] - self.Layers_temperature_dict[layer]) \
-                            + self.U_WALL * self.LAYER_WALL_AREA * (self.T_environment - self.Layers_temperature_dict[layer]) \
-                            ) / (self.LAYER_WATER_MASS * self.Cp_water) \
-                        ) * self.dt + self.Layers_temperature_dict[layer]
-                else:
-                    raise ValueError("Layer {0} is unknown".format(layer))
-
-            self.T_out = self.Layers_temperature_dict[self.Layers_list[-1:][0]]
+        self.mdot_up = - self.mdot_dis_out
+
+        operator, source = self._get_operator()
+
+        if self.solver == 'explicit':
+            # Internal time step (a layer must not lose more heat than it contains in one time step)
+            self.n_substeps = 1
+            if self.substepping:
+                dt_stable = self.max_courant * self.LAYER_HEAT_CAPACITY / np.max(np.abs(operator[1]))
+                self.n_substeps = max(1, int(np.ceil(self.dt / dt_stable)))
+
+            # Forward Euler
+            scale = self.dt / self.n_substeps / self.LAYER_HEAT_CAPACITY
+            T = self.Layers_temperature
+            for _ in range(self.n_substeps):
+                dT = operator[1] * T + source
+                dT[:-1] += operator[0, 1:] * T[1:]
+                dT[1:] += operator[2, :-1] * T[:-1]
+                T = T + scale * dT
+            self.Layers_temperature = T
+
+        elif self.solver == 'implicit':
+            # Backward Euler: (I - dt/C * A) T_new = T + dt/C * b
+            scale = self.dt / self.LAYER_HEAT_CAPACITY
+            system = - scale * operator
+            system[1] += 1
+            self.Layers_temperature = solve_banded((1, 1), system, self.Layers_temperature + scale * source)
 
-        if self.mdot_ch_in < 0 or self.mdot_dis_out > 0:
-            raise ValueError('Unknown value for incoming mass flow mdot_ch_in: {0} and outgoing mass flow mdot_dis_out: {1}'.format(self.mdot_ch_in, self.mdot_dis_out))
+        else:
+            raise ValueError('Unknown solver: {0}'.format(self.solver))
+
+        self.T_out = self.Layers_temperature[-1]
+        self.T_hot = self.Layers_temperature[0]
+        self.T_cold = self.Layers_temperature[-1]
+
+    def _get_operator(self):
+        # Advection (in banded storage, see initialize_stratification) - [W/degK]
+        operator = self.conduction_operator.copy()
+        operator[0, 1:] += self.mdot_up * self.Cp_water
+        operator[2, :-1] += self.mdot_down * self.Cp_water
+        operator[1] -= (self.mdot_down + self.mdot_up) * self.Cp_water
+
+        # Inflows at the top (charging) and the bottom (discharging) of the tank - [W]
+        source = self.wall_loss_source.copy()
+        source[0] += self.mdot_down * self.Cp_water * self.T_ch_in
+        source[-1] += self.mdot_up * self.Cp_water * self.T_dis_in
 
-        self.T_hot = self.Layers_temperature_dict[0]
-        self.T_cold = self.Layers_temperature_dict[self.Layers_list[-1:][0]]
+        return operator, source
 
 
 if __name__ == '__main__':